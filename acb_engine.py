@@ -0,0 +1,160 @@
+import argparse
+import time
+import numpy as np
+from records import MICRO
+
+# Events per vectorized block. The running ACB is solved one block at a time
+# so the cumulative product of sale ratios cannot underflow.
+BLOCK_SIZE = 1024
+_MIN_PRODUCT = 1e-250
+
+def ledger_columns(transactions, rate_lookup):
+    """Flatten date-sorted Transactions into the columns compute_acb expects.
+
+    RSU records expand into a vest plus its sale-to-cover, as in
+    process_all_data. rate_lookup maps an MM-DD-YYYY date to its FX rate
+    (e.g. RateIndex.lookup). Acquisitions are priced at FMV and sales at the
+    sale price.
+    """
+    deltas, prices, rates = [], [], []
+    for transaction in transactions:
+        fx = rate_lookup(transaction.date)
+        if transaction.type == "RSU":
+            deltas.append(transaction.shares / MICRO)
+            prices.append(transaction.fmv / MICRO)
+            rates.append(fx)
+            if transaction.shares_sold > 0:
+                deltas.append(-transaction.shares_sold / MICRO)
+                prices.append(transaction.sale_price / MICRO)
+                rates.append(fx)
+        elif transaction.type == "ESPP":
+            deltas.append(transaction.shares / MICRO)
+            prices.append(transaction.fmv / MICRO)
+            rates.append(fx)
+        elif transaction.type == "Sale":
+            deltas.append(-abs(transaction.shares_sold) / MICRO)
+            prices.append(transaction.sale_price / MICRO)
+            rates.append(fx)
+    return np.array(deltas, dtype=float), np.array(prices, dtype=float), np.array(rates, dtype=float)
+
+def _apply_skips(deltas):
+    # process_all_data skips a sale when no shares are held. Each skip changes
+    # the holdings after it, so this is the one pass that must run in order.
+    applied = deltas.copy()
+    shares = np.empty_like(deltas)
+    held = 0.0
+    for i, delta in enumerate(deltas.tolist()):
+        if delta < 0 and held <= 0:
+            applied[i] = 0.0
+        else:
+            held = round(held + delta, 8)
+        shares[i] = held
+    return applied, shares, shares - applied
+
+def _running_acb_sequential(added, ratio, carry):
+    out = np.empty_like(added)
+    for i in range(len(added)):
+        carry = carry * ratio[i] + added[i]
+        out[i] = carry
+    return out
+
+def _running_acb(added, ratio):
+    # Solves acb[i] = acb[i-1] * ratio[i] + added[i]. Within a block, with
+    # P = cumprod(ratio), acb = P * (carry + cumsum(added / P)); a ratio of 0
+    # (every share sold) restarts the sum at that event.
+    out = np.empty_like(added)
+    carry = 0.0
+    for lo in range(0, len(added), BLOCK_SIZE):
+        hi = min(lo + BLOCK_SIZE, len(added))
+        a = added[lo:hi]
+        r = ratio[lo:hi]
+        reset = r == 0
+        product = np.cumprod(np.where(reset, 1.0, r))
+        if (r < 0).any() or product.min() < _MIN_PRODUCT:
+            out[lo:hi] = _running_acb_sequential(a, r, carry)
+        else:
+            total = np.cumsum(a / product)
+            last_reset = np.maximum.accumulate(np.where(reset, np.arange(hi - lo), -1))
+            has_reset = last_reset >= 0
+            base = np.where(has_reset, total[np.maximum(last_reset, 0)], 0.0)
+            out[lo:hi] = product * (np.where(has_reset, 0.0, carry) + total - base)
+        carry = out[hi - 1]
+    return out
+
+def compute_acb(deltas, prices, rates):
+    """Average-cost ACB and capital gains for a whole ledger at once.
+
+    deltas are signed share changes (positive for acquisitions, negative for
+    sales), prices the USD price per share (FMV or sale price) and rates the
+    USD->CAD rate of each event, all in date order. Returns a dict of arrays
+    mirroring the running totals and sale fields process_all_data produces
+    before superficial losses; denied losses (see superficial_loss.py) are
+    not applied here, so ledgers with them will differ.
+    """
+    deltas = np.asarray(deltas, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    rates = np.asarray(rates, dtype=float)
+
+    applied, shares, shares_before = _apply_skips(deltas)
+    sells = applied < 0
+    shares_sold = np.where(sells, -applied, 0.0)
+
+    added_usd = np.where(applied > 0, applied * prices, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(sells, shares / shares_before, 1.0)
+    acb_usd = _running_acb(added_usd, ratio)
+
+    acb_before = np.concatenate(([0.0], acb_usd[:-1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        acb_per_share = np.where(sells, acb_before / shares_before, 0.0)
+    acb_sold_usd = shares_sold * acb_per_share
+    proceeds_usd = shares_sold * prices
+    gain_usd = proceeds_usd - acb_sold_usd
+
+    return {
+        "skipped": applied != deltas,
+        "shares": shares,
+        "acb_usd": acb_usd,
+        "acb_cad": acb_usd * rates,
+        "proceeds_usd": proceeds_usd,
+        "acb_sold_usd": acb_sold_usd,
+        "acb_sold_cad": acb_sold_usd * rates,
+        "capital_gain_loss_usd": gain_usd,
+        "capital_gain_loss_cad": gain_usd * rates,
+    }
+
+def synthetic_columns(n, seed=0):
+    """Random ledger columns: acquisitions and partial sales of the holdings."""
+    rng = np.random.default_rng(seed)
+    sells = rng.random(n) < 0.4
+    sells[0] = False
+    sizes = rng.integers(5, 40, n).astype(float)
+    fractions = rng.uniform(0.05, 0.6, n)
+    deltas = np.empty(n)
+    held = 0.0
+    for i in range(n):
+        # Sell a whole-share fraction of what is held, so holdings stay bounded
+        deltas[i] = -max(1.0, np.floor(held * fractions[i])) if sells[i] else sizes[i]
+        held += deltas[i]
+    prices = np.round(rng.uniform(20, 200, n), 2)
+    rates = np.round(rng.uniform(1.2, 1.45, n), 4)
+    return deltas, prices, rates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the vectorized ACB engine.")
+    parser.add_argument("--events", type=int, default=100_000)
+    args = parser.parse_args()
+
+    columns = synthetic_columns(args.events, seed=1)
+    start = time.perf_counter()
+    compute_acb(*columns)
+    print(f"compute_acb on {args.events} events: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # Sales before anything is held are skipped; there used to be one pass per skip
+    skips = args.events // 30
+    skipped_columns = [np.concatenate((np.full(skips, fill), column))
+                       for fill, column in zip((-1.0, 50.0, 1.3), columns)]
+    start = time.perf_counter()
+    compute_acb(*skipped_columns)
+    print(f"compute_acb on {args.events} events after {skips} skipped sales: "
+          f"{(time.perf_counter() - start) * 1000:.1f} ms")
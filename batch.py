@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from exchange_rate import RATE_DB_PATH, RateStore, use_rate_store
+from main import process_all_data
+
+def find_employees(root_dir):
+    """Per-employee input folders under root_dir: any subfolder with pdfs/ or sells.csv."""
+    employees = []
+    for name in sorted(os.listdir(root_dir)):
+        folder = os.path.join(root_dir, name)
+        if os.path.isdir(os.path.join(folder, "pdfs")) or os.path.isfile(os.path.join(folder, "sells.csv")):
+            employees.append(name)
+    return employees
+
+def run_employee(name, input_dir, output_dir, fx_db, pdf_workers=1, incremental=False):
+    """Build one employee's report; runs inside a batch worker process.
+
+    Every file the run writes (workbook, state log, checkpoint, PDF cache and
+    a run.log of its console output) goes to output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    use_rate_store(fx_db)
+    result = {"employee": name, "output": os.path.join(output_dir, "stock_tracker.xlsx")}
+    start = time.perf_counter()
+    try:
+        with open(os.path.join(output_dir, "run.log"), "w") as log, redirect_stdout(log):
+            holdings = process_all_data(
+                pdf_dir=os.path.join(input_dir, "pdfs"),
+                sales_csv=os.path.join(input_dir, "sells.csv"),
+                output_path=result["output"],
+                pdf_workers=pdf_workers,
+                pdf_cache=os.path.join(output_dir, "pdf_cache.json"),
+                incremental=incremental,
+                checkpoint_path=os.path.join(output_dir, "ledger_checkpoint.json"),
+            )
+        result.update({
+            "status": "ok",
+            "transactions": holdings["transactions"],
+            "shares": float(holdings["shares"]),
+            "acb_usd": float(holdings["acb_usd"]),
+            "acb_cad": float(holdings["acb_cad"]),
+        })
+    except Exception as e:
+        result.update({"status": "failed", "error": str(e)})
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def run_batch(root_dir, output_root="reports", workers=None, fx_db=RATE_DB_PATH,
+              pdf_workers=1, incremental=False):
+    """Process every employee folder under root_dir in a pool of worker processes.
+
+    All workers share the FX rate store in fx_db, so a month any run has
+    already cached is not downloaded again. Workers are not coordinated, so
+    with a cold store several of them may fetch the same missing months at
+    the same time. Writes batch_summary.json to output_root and returns its
+    contents.
+    """
+    employees = find_employees(root_dir)
+    os.makedirs(output_root, exist_ok=True)
+    # Create the shared store's schema before workers race to do it
+    RateStore(fx_db)._connect().close()
+
+    start = time.perf_counter()
+    args = [(name, os.path.join(root_dir, name), os.path.join(output_root, name),
+             fx_db, pdf_workers, incremental) for name in employees]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_employee, *zip(*args))) if args else []
+
+    summary = {
+        "root_dir": os.path.abspath(root_dir),
+        "employees": len(results),
+        "failed": sum(1 for result in results if result["status"] != "ok"),
+        "seconds": time.perf_counter() - start,
+        "results": results,
+    }
+    with open(os.path.join(output_root, "batch_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build tax reports for every employee folder (pdfs/ + sells.csv) under a root directory.")
+    parser.add_argument("root_dir")
+    parser.add_argument("--output-dir", default="reports")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="employees processed at once (default: CPU count)")
+    parser.add_argument("--pdf-workers", type=int, default=1,
+                        help="processes each employee uses to parse PDFs")
+    parser.add_argument("--fx-db", default=RATE_DB_PATH, help="FX rate store shared by all workers")
+    parser.add_argument("--incremental", action="store_true")
+    args = parser.parse_args()
+
+    summary = run_batch(args.root_dir, args.output_dir, args.workers, args.fx_db,
+                        args.pdf_workers, args.incremental)
+    for result in summary["results"]:
+        if result["status"] == "ok":
+            print(f"{result['employee']}: {result['transactions']} transactions, "
+                  f"{result['shares']:.4f} shares, ACB ${result['acb_usd']:.2f} USD "
+                  f"({result['seconds']:.1f}s)")
+        else:
+            print(f"{result['employee']}: FAILED - {result['error']}")
+    print(f"{summary['employees']} employees in {summary['seconds']:.1f}s, {summary['failed']} failed")
@@ -0,0 +1,236 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+import instrumentation
+from exchange_rate import use_rate_store
+from main import process_all_data
+from ledger_state import state_log_path
+
+# Synthetic ledgers run over business days from here up to a week before today
+LEDGER_START = date(2015, 1, 5)
+
+def make_pdf(lines):
+    """Build a one-page PDF whose extracted text is the given lines."""
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    ops = ["BT", "/F1 10 Tf", "14 TL", "50 760 Td"]
+    ops += [f"({escape(line)}) Tj T*" for line in lines]
+    ops.append("ET")
+    stream = "\n".join(ops).encode("latin-1")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+def rsu_confirmation(release_date, shares, fmv, shares_sold, sale_price):
+    return make_pdf([
+        "EMPLOYEE STOCK PLAN RELEASE CONFIRMATION",
+        f"Release Date {release_date}",
+        f"Shares Released {shares:.4f}",
+        f"Market Value Per Share ${fmv:.4f}",
+        f"Shares Sold ({shares_sold:.4f})",
+        f"Sale Price Per Share ${sale_price:.4f}",
+    ])
+
+def espp_confirmation(purchase_date, shares, fmv):
+    return make_pdf([
+        "EMPLOYEE STOCK PLAN PURCHASE CONFIRMATION",
+        f"Purchase Date {purchase_date}",
+        f"Shares Purchased {shares:.4f}",
+        f"Purchase Value per Share ${fmv:.4f}",
+        f"Purchase Price per Share (85.000% of ${fmv:.4f}) ${fmv * 0.85:.4f}",
+    ])
+
+def business_days(start, end):
+    days = []
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def generate_inputs(workdir, transactions, pdf_fraction=0.1, seed=0):
+    """Write pdfs/, sells.csv and an offline FX fixture for a synthetic ledger.
+
+    About pdf_fraction of the transactions are RSU release / ESPP purchase
+    confirmations, large enough that the sales in sells.csv never run out of
+    shares. Returns the paths of the generated inputs.
+    """
+    rng = random.Random(seed)
+    days = business_days(LEDGER_START, date.today() - timedelta(days=7))
+    pdf_dir = os.path.join(workdir, "pdfs")
+    os.makedirs(pdf_dir, exist_ok=True)
+    for filename in os.listdir(pdf_dir):
+        os.remove(os.path.join(pdf_dir, filename))
+
+    n_pdfs = max(1, round(transactions * pdf_fraction))
+    n_sales = max(0, transactions - n_pdfs)
+    shares_per_pdf = 4 * (n_sales // n_pdfs + 1)
+
+    # Acquisitions are spread evenly over the span; the first is on day one
+    for i in range(n_pdfs):
+        day = days[i * len(days) // n_pdfs]
+        price = round(rng.uniform(40, 160), 4)
+        if i % 2 == 0:
+            pdf = rsu_confirmation(day.strftime("%m-%d-%Y"), shares_per_pdf, price,
+                                   round(shares_per_pdf * 0.3), round(price * 0.99, 4))
+        else:
+            pdf = espp_confirmation(day.strftime("%m-%d-%Y"), shares_per_pdf, price)
+        with open(os.path.join(pdf_dir, f"confirmation_{i:06d}.pdf"), "wb") as f:
+            f.write(pdf)
+
+    sales_csv = os.path.join(workdir, "sells.csv")
+    sale_days = sorted(rng.choice(days[1:]) for _ in range(n_sales))
+    with open(sales_csv, "w") as f:
+        f.write("Transaction,Date & Time,Sale Quantity,Price\n")
+        for day in sale_days:
+            f.write(f"Order Executed,{day.strftime('%m/%d/%Y')} 10:42:26 AM ET,"
+                    f"{rng.randint(1, 3)},{rng.uniform(40, 160):.3f}\n")
+
+    fx_fixture = os.path.join(workdir, "fx_fixture.json")
+    observations = [{"d": day.isoformat(), "FXUSDCAD": {"v": f"{rng.uniform(1.2, 1.45):.4f}"}}
+                    for day in business_days(LEDGER_START - timedelta(days=31), date.today())]
+    with open(fx_fixture, "w") as f:
+        json.dump({"observations": observations}, f)
+
+    return pdf_dir, sales_csv, fx_fixture
+
+def load_fx_fixture(fx_fixture, store):
+    """Fill a RateStore from a Valet-format JSON file so no HTTP calls are made."""
+    with open(fx_fixture) as f:
+        observations = [(obs["d"], float(obs["FXUSDCAD"]["v"])) for obs in json.load(f)["observations"]]
+    months = {}
+    for obs_date, rate in observations:
+        months.setdefault(obs_date[:7], []).append((obs_date, rate))
+    for month, month_obs in months.items():
+        store.put_month(month, month_obs)
+
+def run_benchmark(workdir, transactions, pdf_fraction=0.1, workers=None, seed=0):
+    """Generate a ledger of the given size and time each stage of process_all_data.
+
+    The pipeline runs twice, so PDF ingestion is timed both cold and from the
+    cache; stages and counters are those of the first run.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    pdf_dir, sales_csv, fx_fixture = generate_inputs(workdir, transactions, pdf_fraction, seed)
+    store = use_rate_store(os.path.join(workdir, "fx_rates.sqlite"))
+    load_fx_fixture(fx_fixture, store)
+    output_path = os.path.join(workdir, "stock_tracker.xlsx")
+    pdf_cache = os.path.join(workdir, "pdf_cache.json")
+    checkpoint_path = os.path.join(workdir, "ledger_checkpoint.json")
+    for path in (output_path, pdf_cache, checkpoint_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    def run():
+        instrumentation.start_report()
+        start = time.perf_counter()
+        try:
+            # Pipeline chatter ("Skipped ...", "Using nearest rate ...") is not timed output
+            with redirect_stdout(io.StringIO()):
+                result = process_all_data(pdf_dir, sales_csv, output_path, pdf_workers=workers,
+                                          pdf_cache=pdf_cache, checkpoint_path=checkpoint_path)
+        finally:
+            report = instrumentation.stop_report()
+        return result, report, time.perf_counter() - start
+
+    try:
+        result, report, total = run()
+        _, cached_report, _ = run()
+    finally:
+        store.close()
+
+    stages = dict(report.stages)
+    stages["pdf_ingest_cached"] = cached_report.stages["pdf_ingest"]
+    return {
+        "transactions": result["transactions"],
+        "pdfs": len(os.listdir(pdf_dir)),
+        "rows_written": report.counters.get("rows_written", 0),
+        "stages": stages,
+        "counters": report.counters,
+        "total": total,
+    }
+
+def time_query_startup(state_path, runs=5):
+    """Median wall time of a cold `main.py query` process, next to a bare interpreter."""
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+    def median_run(command):
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, capture_output=True)
+            samples.append(time.perf_counter() - start)
+        return statistics.median(samples)
+
+    return {
+        "query_seconds": median_run([sys.executable, main_py, "query", "--ledger", state_path]),
+        "interpreter_seconds": median_run([sys.executable, "-c", "pass"]),
+        "runs": runs,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each stage of the pipeline on synthetic ledgers.")
+    parser.add_argument("--sizes", default="10,1000,100000",
+                        help="comma-separated ledger sizes, in transactions")
+    parser.add_argument("--pdf-fraction", type=float, default=0.1,
+                        help="share of each ledger that comes from confirmation PDFs")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used to parse PDFs (default: CPU count)")
+    parser.add_argument("--workdir", default="bench_data")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        result = run_benchmark(os.path.join(args.workdir, str(size)), size, args.pdf_fraction, args.workers)
+        results.append(result)
+        stages = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in result["stages"].items())
+        print(f"{size} transactions: {result['total']:.3f}s ({stages})")
+
+    startup = time_query_startup(state_log_path(os.path.join(args.workdir, str(size), "stock_tracker.xlsx")))
+    print(f"main.py query cold start: {startup['query_seconds']:.3f}s "
+          f"(bare interpreter {startup['interpreter_seconds']:.3f}s)")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "results": results,
+            "query_startup": startup,
+        }, f, indent=2)
+    print(f"Saved {args.output}")
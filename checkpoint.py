@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+from decimal import Decimal
+from records import date_ordinal
+from superficial_loss import WINDOW_DAYS
+
+CHECKPOINT_PATH = "ledger_checkpoint.json"
+
+def inputs_fingerprint(transactions):
+    """Hash of a run's input transactions, independent of their order."""
+    keys = sorted(json.dumps(t.to_dict(), sort_keys=True) for t in transactions)
+    h = hashlib.sha256()
+    for key in keys:
+        h.update(key.encode())
+        h.update(b"\n")
+    return h.hexdigest()
+
+def load_checkpoint(checkpoint_path=CHECKPOINT_PATH):
+    try:
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    for field in ("shares", "acb_usd", "acb_cad"):
+        checkpoint[field] = Decimal(checkpoint[field])
+    return checkpoint
+
+def save_checkpoint(transactions, shares, acb_usd, acb_cad, output_path,
+                    checkpoint_path=CHECKPOINT_PATH, last_loss_date=None):
+    """Record the running state after processing the sorted transactions.
+
+    last_loss_date is the latest sale at a loss, whose superficial-loss window
+    may still be open.
+    """
+    checkpoint = {
+        "shares": str(shares),
+        "acb_usd": str(acb_usd),
+        "acb_cad": str(acb_cad),
+        "last_date": transactions[-1].date if transactions else None,
+        "count": len(transactions),
+        "fingerprint": inputs_fingerprint(transactions),
+        "last_loss_date": last_loss_date,
+        "output_path": os.path.abspath(output_path),
+    }
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+def resume_index(checkpoint, transactions, output_path):
+    """Index of the first transaction not yet covered by the checkpoint.
+
+    transactions must be sorted by date. Returns 0 (full replay) when there is
+    no usable checkpoint, when any transaction dated on or before the
+    checkpoint's last date was added, removed or changed since it was saved,
+    or when a new transaction falls in the superficial-loss window of a sale
+    already processed.
+    """
+    if checkpoint is None or checkpoint["last_date"] is None:
+        return 0
+    if checkpoint.get("output_path") != os.path.abspath(output_path) or not os.path.exists(output_path):
+        print("Checkpoint does not match the output workbook; replaying full history")
+        return 0
+
+    last_ordinal = date_ordinal(checkpoint["last_date"])
+    start = 0
+    while start < len(transactions) and transactions[start].ordinal <= last_ordinal:
+        start += 1
+
+    if start != checkpoint["count"] or inputs_fingerprint(transactions[:start]) != checkpoint["fingerprint"]:
+        print(f"Inputs on or before {checkpoint['last_date']} changed; replaying full history")
+        return 0
+
+    loss_date = checkpoint.get("last_loss_date")
+    if (loss_date and start < len(transactions)
+            and transactions[start].ordinal <= date_ordinal(loss_date) + WINDOW_DAYS):
+        print(f"New transactions fall within {WINDOW_DAYS} days of the loss on {loss_date}; "
+              "replaying full history")
+        return 0
+    return start
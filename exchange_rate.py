@@ -1,40 +1,321 @@
-import requests
+import atexit
+import os
+import sqlite3
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import time
 import warnings
-from datetime import datetime, timedelta
-from urllib3.exceptions import NotOpenSSLWarning
+import instrumentation
+from datetime import date, datetime, timedelta
 
-# Ignore the NotOpenSSLWarning
-warnings.filterwarnings("ignore", category=NotOpenSSLWarning)
+VALET_URL = os.environ.get("FX_VALET_URL", "https://www.bankofcanada.ca/valet")
+RATE_DB_PATH = os.environ.get("FX_RATE_DB", "fx_rates.sqlite")
+# Seconds before the cached copy of a not-yet-finished month is fetched again
+CURRENT_MONTH_MAX_AGE = int(os.environ.get("FX_CURRENT_MONTH_MAX_AGE", 6 * 3600))
+# Calendar days fetched before the first transaction so the earliest one still
+# has a prior business day to fall back on (covers the Christmas closure)
+LOOKBACK_DAYS = 10
+# Upper bound on the months covered by one ranged Valet request
+MAX_MONTHS_PER_REQUEST = 60
+# HTTP behaviour on a cache miss: windows fetched at once, per-request timeout
+# in seconds, and retries with exponential backoff (0.5s, 1s, 2s, ...)
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("FX_MAX_CONCURRENT_REQUESTS", 4))
+REQUEST_TIMEOUT = float(os.environ.get("FX_REQUEST_TIMEOUT", 15))
+MAX_RETRIES = 4
+BACKOFF_FACTOR = 0.5
 
-def get_exchange_rate(date_str):
-    print(f"Fetching exchange rate for {date_str}")
+class RateStore:
+    """Local store of FXUSDCAD observations, one entry per fetched month.
+
+    Months are kept in an SQLite file so reruns answer lookups from disk, and
+    in a per-process memo so repeated lookups skip SQLite as well. A month
+    fetched after it ended is final and never fetched again; any other copy
+    (the current month, or a month cached before it ended) is refetched once
+    it is older than max_age seconds.
+    """
+
+    def __init__(self, path=RATE_DB_PATH, max_age=CURRENT_MONTH_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._memo = {}  # "YYYY-MM" -> (fetched_at, complete, [(date, rate), ...])
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            # WAL lets several processes (see batch.py) read while one writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS months (
+                    month TEXT PRIMARY KEY,
+                    fetched_at REAL NOT NULL,
+                    complete INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS observations (
+                    date TEXT PRIMARY KEY,
+                    rate REAL NOT NULL
+                );
+            """)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(months)")]
+            if "complete" not in columns:
+                # Stores from before the flag existed: treat every month as
+                # possibly partial, so each is refetched once it goes stale
+                self._conn.execute("ALTER TABLE months ADD COLUMN complete INTEGER NOT NULL DEFAULT 0")
+        return self._conn
+
+    def _is_fresh(self, fetched_at, complete):
+        return complete or time.time() - fetched_at <= self.max_age
+
+    def get_month(self, month):
+        """Return the cached observations for month, or None if missing or stale."""
+        cached = self._memo.get(month)
+        if cached is None:
+            conn = self._connect()
+            row = conn.execute("SELECT fetched_at, complete FROM months WHERE month = ?",
+                               (month,)).fetchone()
+            if row is None:
+                instrumentation.incr("fx_cache_misses")
+                return None
+            observations = conn.execute(
+                "SELECT date, rate FROM observations WHERE date LIKE ? ORDER BY date",
+                (f"{month}-%",)
+            ).fetchall()
+            cached = (row[0], bool(row[1]), observations)
+            self._memo[month] = cached
+
+        fetched_at, complete, observations = cached
+        if not self._is_fresh(fetched_at, complete):
+            instrumentation.incr("fx_cache_misses")
+            return None
+        instrumentation.incr("fx_cache_hits")
+        return observations
+
+    def put_month(self, month, observations):
+        """Save a month's observations, replacing any earlier copy.
+
+        The copy is final only if the month had already ended when it was fetched.
+        """
+        fetched_at = time.time()
+        complete = _month_complete(month)
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM observations WHERE date LIKE ?", (f"{month}-%",))
+            conn.executemany("INSERT INTO observations (date, rate) VALUES (?, ?)", observations)
+            conn.execute("INSERT OR REPLACE INTO months (month, fetched_at, complete) VALUES (?, ?, ?)",
+                         (month, fetched_at, int(complete)))
+        self._memo[month] = (fetched_at, complete, list(observations))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+_default_store = None
+
+def get_rate_store():
+    """Return the process-wide RateStore, opening it on first use."""
+    global _default_store
+    if _default_store is None:
+        _default_store = RateStore()
+    return _default_store
+
+def use_rate_store(path, max_age=CURRENT_MONTH_MAX_AGE):
+    """Point this process's lookups at the rate store in path."""
+    global _default_store
+    if _default_store is not None:
+        _default_store.close()
+    _default_store = RateStore(path, max_age)
+    return _default_store
+
+def _month_complete(month):
+    year, mon = map(int, month.split("-"))
+    first_of_next = date(year + mon // 12, mon % 12 + 1, 1)
+    return first_of_next <= date.today()
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def _get_session():
+    """The process's keep-alive session, with retries and backoff built in.
+
+    One session is shared by every fetch thread: its connection pool is
+    thread-safe and sized for MAX_CONCURRENT_REQUESTS, so connections are
+    reused across windows and across prefetches. It is closed at exit.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        # A session inherited through fork (batch workers) shares its sockets
+        # with the parent, so each process opens its own
+        if _session is None or _session_pid != os.getpid():
+            # requests is only needed on a cache miss, so it is imported lazily
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.exceptions import NotOpenSSLWarning
+            from urllib3.util.retry import Retry
+
+            # Ignore the NotOpenSSLWarning
+            warnings.filterwarnings("ignore", category=NotOpenSSLWarning)
+
+            retry = Retry(total=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR,
+                          status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+            adapter = HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if _session_pid is None:
+                atexit.register(close_session)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+def close_session():
+    """Close the shared HTTP session; the next fetch opens a new one."""
+    global _session
+    with _session_lock:
+        if _session is not None and _session_pid == os.getpid():
+            _session.close()
+        _session = None
+
+def fetch_observations(start_date, end_date):
+    """Download FXUSDCAD observations between two YYYY-MM-DD dates (inclusive)."""
+    url = f"{VALET_URL}/observations/FXUSDCAD/json?start_date={start_date}&end_date={end_date}"
+    instrumentation.incr("fx_http_calls")
+    response = _get_session().get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return [(obs["d"], float(obs["FXUSDCAD"]["v"])) for obs in response.json().get("observations", [])]
+
+def fetch_windows(windows, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    """Fetch several (start_date, end_date) windows at once, at most max_concurrency in flight.
+
+    Returns each window's observations in the order the windows were given.
+    """
+    if len(windows) <= 1 or max_concurrency <= 1:
+        return [fetch_observations(start, end) for start, end in windows]
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(windows))) as pool:
+        return list(pool.map(lambda window: fetch_observations(*window), windows))
+
+def get_month_observations(date_obj, store=None):
+    """Return the (date, rate) observations for the month containing date_obj."""
+    store = store or get_rate_store()
+    month = date_obj.strftime("%Y-%m")
+
+    observations = store.get_month(month)
+    if observations is None:
+        # Calculate first and last day of the month
+        first_day = date_obj.replace(day=1).strftime("%Y-%m-%d")
+        last_day = (date_obj.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        last_day = last_day.strftime("%Y-%m-%d")
+
+        # Fetch data for the entire month
+        print(f"Fetching exchange rates for {month}")
+        observations = fetch_observations(first_day, last_day)
+        store.put_month(month, observations)
+    return observations
+
+def _month_bounds(month):
+    year, mon = map(int, month.split("-"))
+    first_day = date(year, mon, 1)
+    last_day = date(year + mon // 12, mon % 12 + 1, 1) - timedelta(days=1)
+    return first_day, last_day
+
+def _months_between(start, end):
+    months = []
+    year, mon = start.year, start.month
+    while (year, mon) <= (end.year, end.month):
+        months.append(f"{year:04d}-{mon:02d}")
+        year, mon = year + mon // 12, mon % 12 + 1
+    return months
+
+def _to_iso(date_str):
+    # MM-DD-YYYY -> YYYY-MM-DD without going through strptime
+    return f"{date_str[6:10]}-{date_str[0:2]}-{date_str[3:5]}"
+
+class RateIndex:
+    """Sorted date -> rate index over FXUSDCAD observations.
+
+    lookup() returns the rate for the exact date, else the rate of the nearest
+    prior business day, found by binary search.
+    """
+
+    def __init__(self, observations):
+        observations = sorted(observations)
+        self.dates = [obs_date for obs_date, _ in observations]
+        self.rates = [rate for _, rate in observations]
+
+    def lookup(self, date_str):
+        instrumentation.incr("fx_lookups")
+        target_date = _to_iso(date_str)
+        if target_date > date.today().isoformat():
+            raise ValueError(f"Date {date_str} is in the future. No exchange rate available.")
+
+        i = bisect_right(self.dates, target_date) - 1
+        if i < 0:
+            raise ValueError(f"No exchange rate data found on or before {date_str}.")
+        if self.dates[i] != target_date:
+            print(f"Using nearest rate from {self.dates[i]}")
+        return self.rates[i]
+
+def prefetch_exchange_rates(start_date_str, end_date_str, store=None):
+    """Load every rate needed between two MM-DD-YYYY dates and return a RateIndex.
+
+    Months missing from the store are downloaded with as few ranged requests
+    as possible instead of one request per transaction.
+    """
+    store = store or get_rate_store()
+    start = datetime.strptime(start_date_str, "%m-%d-%Y").date() - timedelta(days=LOOKBACK_DAYS)
+    end = min(datetime.strptime(end_date_str, "%m-%d-%Y").date(), date.today())
+
+    observations = []
+    missing = []
+    for month in _months_between(start, end):
+        cached = store.get_month(month)
+        if cached is None:
+            missing.append(month)
+        else:
+            observations.extend(cached)
+
+    # Group consecutive missing months into ranged requests
+    runs = []
+    for month in missing:
+        if (runs and len(runs[-1]) < MAX_MONTHS_PER_REQUEST
+                and _month_bounds(runs[-1][-1])[1] + timedelta(days=1) == _month_bounds(month)[0]):
+            runs[-1].append(month)
+        else:
+            runs.append([month])
+
+    windows = [(_month_bounds(run[0])[0].isoformat(), _month_bounds(run[-1])[1].isoformat())
+               for run in runs]
+    for first_day, last_day in windows:
+        print(f"Fetching exchange rates for {first_day} to {last_day}")
+
+    for run, fetched in zip(runs, fetch_windows(windows)):
+        for month in run:
+            month_obs = [obs for obs in fetched if obs[0].startswith(month)]
+            store.put_month(month, month_obs)
+            observations.extend(month_obs)
+
+    return RateIndex(observations)
+
+def get_exchange_rate(date_str, store=None):
     # Parse input date (MM-DD-YYYY)
     date_obj = datetime.strptime(date_str, "%m-%d-%Y")
-    
+
     # Check if date is in the future
     if date_obj > datetime.now():
         raise ValueError(f"Date {date_str} is in the future. No exchange rate available.")
-    
-    # Calculate first and last day of the month
-    first_day = date_obj.replace(day=1).strftime("%Y-%m-%d")
-    last_day = (date_obj.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
-    last_day = last_day.strftime("%Y-%m-%d")
-    
-    # Fetch data for the entire month
-    url = f"https://www.bankofcanada.ca/valet/observations/FXUSDCAD/json?start_date={first_day}&end_date={last_day}"
-    response = requests.get(url).json()
-    
+
+    observations = get_month_observations(date_obj, store)
+
+    # Nothing on or before the date this month: fall back into the previous month
+    target_date = date_obj.strftime("%Y-%m-%d")
+    if not observations or observations[0][0] > target_date:
+        previous_month = date_obj.replace(day=1) - timedelta(days=1)
+        observations = get_month_observations(previous_month, store) + observations
+
     # Check for valid response
-    if "observations" not in response or len(response["observations"]) == 0:
+    if len(observations) == 0:
         raise ValueError(f"No exchange rate data found for {date_str} or its month.")
-    
-    # Find the rate for the exact date
-    target_date = date_obj.strftime("%Y-%m-%d")
-    for observation in response["observations"]:
-        if observation["d"] == target_date:
-            return float(observation["FXUSDCAD"]["v"])
-    
-    # If exact date not found, use the latest available date in the month
-    latest_observation = response["observations"][-1]
-    print(f"Using nearest rate from {latest_observation['d']}")
-    return float(latest_observation["FXUSDCAD"]["v"])
\ No newline at end of file
+
+    # Exact date if published, else the nearest prior business day
+    return RateIndex(observations).lookup(date_str)
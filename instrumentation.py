@@ -0,0 +1,60 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+class RunReport:
+    """Wall time per pipeline stage plus named counters for one run."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def incr(self, name, amount=1):
+        # FX windows are fetched from several threads at once
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self):
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "wall_time": time.time() - self.started_at,
+            "stages": self.stages,
+            "counters": self.counters,
+        }
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+# Report being filled in by this process, or None when instrumentation is off
+_active = None
+
+def start_report():
+    """Turn instrumentation on and return the report that will collect it."""
+    global _active
+    _active = RunReport()
+    return _active
+
+def stop_report():
+    global _active
+    report, _active = _active, None
+    return report
+
+def stage(name):
+    """Time a block as a pipeline stage; does nothing when no report is active."""
+    return _active.stage(name) if _active is not None else nullcontext()
+
+def incr(name, amount=1):
+    if _active is not None:
+        _active.incr(name, amount)
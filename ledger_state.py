@@ -0,0 +1,160 @@
+import math
+import os
+import sqlite3
+from datetime import date
+from records import date_ordinal
+from tax_periods import get_calendar
+
+# Running state after every Transactions row plus a snapshot at each year end,
+# kept next to the workbook so point-in-time and per-year queries never have
+# to load the xlsx (or pandas)
+_SCHEMA = """
+CREATE TABLE events (
+    seq INTEGER PRIMARY KEY,
+    ordinal INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    type TEXT NOT NULL,
+    shares REAL NOT NULL,
+    acb_usd REAL NOT NULL,
+    acb_cad REAL NOT NULL,
+    period TEXT,
+    inclusion_rate REAL,
+    proceeds_usd REAL,
+    proceeds_cad REAL,
+    cost_basis_usd REAL,
+    cost_basis_cad REAL
+);
+CREATE INDEX events_by_date ON events (ordinal, seq);
+CREATE TABLE year_end (
+    year INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    shares REAL NOT NULL,
+    acb_usd REAL NOT NULL,
+    acb_cad REAL NOT NULL
+);
+"""
+
+SALE_TYPES = ("Sale", "Sale_to_Cover", "Superficial_Loss")
+
+def state_log_path(output_path):
+    """stock_tracker.xlsx -> stock_tracker.state.sqlite"""
+    return os.path.splitext(output_path)[0] + ".state.sqlite"
+
+def _number(value):
+    # Cells left empty come back as None, or NaN when read from the workbook
+    return 0.0 if value is None or (isinstance(value, float) and math.isnan(value)) else float(value)
+
+def _event(seq, row):
+    shares = _number(row.get("Shares Remaining"))
+    event = [seq, date_ordinal(row["Date"]), row["Date"], row["Type"], shares,
+             _number(row.get("ACB Remaining (USD)")), _number(row.get("ACB Remaining (CAD)"))]
+    if row["Type"] not in SALE_TYPES:
+        return event + [None] * 6
+
+    # Same figures summarize_sales derives from the Transactions sheet
+    shares_sold = abs(_number(row.get("Shares Added/Sold")))
+    impact_usd = _number(row.get("ACB Impact (USD)"))
+    impact_cad = _number(row.get("ACB Impact (CAD)"))
+    if row["Type"] == "Superficial_Loss":
+        cost_usd, cost_cad = -impact_usd, -impact_cad
+    else:
+        cost_usd, cost_cad = abs(impact_usd), abs(impact_cad)
+    return event + [*get_calendar().period_of(row["Date"]),
+                    _number(row.get("Sale Price (USD)")) * shares_sold,
+                    _number(row.get("Sale Price (CAD)")) * shares_sold,
+                    cost_usd, cost_cad]
+
+def save_state_log(path, rows):
+    """Write the running state after each Transactions row, with year-end snapshots."""
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(_SCHEMA)
+        events = [_event(seq, row) for seq, row in enumerate(rows)]
+        conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", events)
+
+        # Last state of each year, carried through years without transactions
+        year_end = {}
+        for event in events:
+            year_end[int(event[2][6:10])] = event[2:3] + event[4:7]
+        if year_end:
+            last = None
+            for year in range(min(year_end), max(year_end) + 1):
+                last = year_end.get(year, last)
+                conn.execute("INSERT INTO year_end VALUES (?, ?, ?, ?, ?)", [year, *last])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+def _open(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No state log at {path}")
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+def _state(date_str, shares, acb_usd, acb_cad):
+    return {
+        "date": date_str,
+        "shares": shares,
+        "acb_usd": acb_usd,
+        "acb_cad": acb_cad,
+        "acb_per_share_usd": acb_usd / shares if shares else 0.0,
+    }
+
+def _state_as_of(conn, ordinal=None):
+    query = "SELECT date, shares, acb_usd, acb_cad FROM events"
+    if ordinal is None:
+        row = conn.execute(query + " ORDER BY seq DESC LIMIT 1").fetchone()
+    else:
+        row = conn.execute(query + " WHERE ordinal <= ? ORDER BY ordinal DESC, seq DESC LIMIT 1",
+                           (ordinal,)).fetchone()
+    return _state(*row) if row else None
+
+def state_as_of(path, date_str=None):
+    """Shares and ACB held at the end of date_str (MM-DD-YYYY), or after the last row.
+
+    Returns None if nothing had been acquired by that date.
+    """
+    conn = _open(path)
+    try:
+        return _state_as_of(conn, None if date_str is None else date_ordinal(date_str))
+    finally:
+        conn.close()
+
+def year_summary(path, year):
+    """Opening and closing state for a tax year, plus its sales grouped by period.
+
+    Periods hold the same totals as the Annual Summary sheet for that year.
+    """
+    conn = _open(path)
+    try:
+        def year_end(y):
+            row = conn.execute("SELECT date, shares, acb_usd, acb_cad FROM year_end WHERE year = ?",
+                               (y,)).fetchone()
+            return _state(*row) if row else _state_as_of(conn, date(y, 12, 31).toordinal())
+
+        periods = []
+        for period, *totals in conn.execute(
+                "SELECT period, SUM(proceeds_usd), SUM(proceeds_cad), SUM(cost_basis_usd), "
+                "SUM(cost_basis_cad), MIN(inclusion_rate), "
+                "SUM((proceeds_cad - cost_basis_cad) * inclusion_rate) FROM events "
+                "WHERE ordinal BETWEEN ? AND ? AND period IS NOT NULL "
+                "GROUP BY period ORDER BY period",
+                (date(year, 1, 1).toordinal(), date(year, 12, 31).toordinal())):
+            proceeds_usd, proceeds_cad, cost_usd, cost_cad, inclusion_rate, taxable_cad = totals
+            periods.append({
+                "period": period,
+                "proceeds_usd": proceeds_usd,
+                "proceeds_cad": proceeds_cad,
+                "cost_basis_usd": cost_usd,
+                "cost_basis_cad": cost_cad,
+                "capital_gain_loss_usd": proceeds_usd - cost_usd,
+                "capital_gain_loss_cad": proceeds_cad - cost_cad,
+                "inclusion_rate": inclusion_rate,
+                "taxable_capital_gain_cad": taxable_cad,
+            })
+        return {"year": year, "opening": year_end(year - 1), "closing": year_end(year), "periods": periods}
+    finally:
+        conn.close()
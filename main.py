@@ -1,164 +1,352 @@
-import os
-from datetime import datetime
-from decimal import Decimal, getcontext
-from pdf_parser import extract_pdf_data
-from exchange_rate import get_exchange_rate
-from tax_calculator import calculate_tax_data, process_sale
-from spreadsheet_updater import update_spreadsheet, create_annual_summary
-from sales_parser import parse_sales_csv
+import argparse
+import cProfile
+from datetime import date
+from decimal import Decimal, getcontext, localcontext
+from pdf_parser import extract_pdf_dir, PDF_CACHE_PATH
+from exchange_rate import prefetch_exchange_rates
+from tax_calculator import calculate_tax_data, process_sale, superficial_loss_adjustment
+from sales_parser import UnsortedSalesError, iter_sales_csv, merge_by_date, parse_sales_csv
+from records import Ledger, Transaction
+from checkpoint import CHECKPOINT_PATH, load_checkpoint, save_checkpoint, resume_index
+import instrumentation
+from ledger_state import save_state_log, state_as_of, state_log_path, year_summary
+from superficial_loss import AcquisitionIndex, last_loss_date
 
 getcontext().prec = 8  # Precision for financial calculations
 
-def process_all_data(pdf_dir="pdfs", sales_csv="sells.csv"):
-    # Initialize tracking in both USD and CAD
-    current_shares = Decimal('0')
-    current_acb_usd = Decimal('0')
-    current_acb_cad = Decimal('0')
-    
-    # Load all transactions
-    all_data = []
-    
-    # 1. Process PDFs (RSU/ESPP)
-    for filename in os.listdir(pdf_dir):
-        if filename.endswith(".pdf"):
-            try:
-                pdf_path = os.path.join(pdf_dir, filename)
-                data = extract_pdf_data(pdf_path)
-                all_data.append(data)
-            except Exception as e:
-                print(f"Skipped {filename}: {str(e)}")
-    
-    # 2. Process Sales CSV
+def load_pdf_transactions(pdf_dir="pdfs", pdf_workers=None, pdf_cache=PDF_CACHE_PATH):
+    """Parse the RSU/ESPP confirmation PDFs, reporting the ones skipped.
+
+    Returns Transactions sorted by date.
+    """
+    records, failures = extract_pdf_dir(pdf_dir, workers=pdf_workers, cache_path=pdf_cache)
+    for filename, error in failures:
+        print(f"Skipped {filename}: {error}")
+    transactions = []
+    for record in records:
+        try:
+            transactions.append(Transaction.from_dict(record))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Skipped {record.get('type', 'PDF')} record dated {record.get('date')}: {str(e)}")
+    transactions.sort(key=lambda transaction: transaction.ordinal)
+    return transactions
+
+def merge_transactions(pdf_records, sales_csv="sells.csv"):
+    """Stream the sales CSV and merge it with the date-sorted PDF records into a Ledger.
+
+    Exports already in date order are merged row by row without a re-sort;
+    anything else falls back to sorting the parsed rows in memory.
+    """
     try:
-        sales = parse_sales_csv(sales_csv)
-        all_data.extend(sales)
+        return Ledger(merge_by_date(pdf_records, iter_sales_csv(sales_csv)))
     except FileNotFoundError:
         print(f"Error: {sales_csv} not found!")
-    
-    # 3. Sort by date
-    all_data.sort(key=lambda x: datetime.strptime(x["date"], "%m-%d-%Y"))
-    
-    # 4. Process transactions with USD-first tracking
-    for transaction in all_data:
+        return Ledger(pdf_records)
+    except UnsortedSalesError:
+        print(f"{sales_csv} is not in date order; sorting it in memory")
+        sales = sorted(parse_sales_csv(sales_csv), key=lambda record: record.ordinal)
+        return Ledger(merge_by_date(pdf_records, sales))
+
+def deny_superficial_loss(superficial, sale_data, sale_tax_data, exchange_rate, writer,
+                          current_shares, current_acb_usd):
+    """Add the superficial part of a sale's loss back to the ACB, with a flagged row.
+
+    Returns the updated ACB in USD.
+    """
+    if superficial is None or sale_tax_data["capital_gain_loss_usd"] >= 0:
+        return current_acb_usd
+    denied_fraction = superficial.denied_fraction(sale_data)
+    if denied_fraction == 0:
+        return current_acb_usd
+
+    adjustment = superficial_loss_adjustment(sale_tax_data, denied_fraction, exchange_rate)
+    current_acb_usd += adjustment["total_acb_usd"]
+    writer.add_row(
+        Transaction("Superficial_Loss", sale_data.ordinal), adjustment, exchange_rate,
+        current_shares,
+        current_acb_usd,
+        current_acb_usd * exchange_rate
+    )
+    instrumentation.incr("superficial_losses")
+    return current_acb_usd
+
+def process_transactions(transactions, rate_index, writer,
+                         current_shares, current_acb_usd, current_acb_cad, superficial=None):
+    """Run the tax math over sorted transactions, adding a row per event to writer.
+
+    Accepts Transactions (or parser dicts, converted on the fly). Takes and
+    returns the running (shares, ACB USD, ACB CAD) totals as Decimals, which
+    stay Decimals throughout; writer rows get floats. With superficial (an
+    AcquisitionIndex over the whole ledger), the superficial part of each
+    loss is denied and added to the ACB.
+    """
+    for transaction in transactions:
         try:
-            exchange_rate = get_exchange_rate(transaction["date"])
-            exchange_rate_dec = Decimal(str(exchange_rate))
+            if not isinstance(transaction, Transaction):
+                transaction = Transaction.from_dict(transaction)
+            exchange_rate = Decimal(str(rate_index.lookup(transaction.date)))
             
-            if transaction["type"] == "RSU":
-                # Verify required fields exist
-                if "shares_vested" not in transaction:
-                    raise KeyError(f"Missing 'shares_vested' in RSU transaction: {transaction}")
-                
+            if transaction.type == "RSU":
                 # ------------------------------------------
                 # Part 1: Vesting (USD-based ACB)
                 # ------------------------------------------
-                vest_data = {
-                    "type": "RSU_Vest",
-                    "date": transaction["date"],
-                    "shares": transaction["shares_vested"],
-                    "fmv_usd": transaction["fmv_usd"]
-                }
+                vest_data = transaction.vest()
                 tax_data = calculate_tax_data(vest_data, exchange_rate)
                 
                 # Update tracking in USD first
-                shares_added = Decimal(str(vest_data["shares"]))
+                shares_added = vest_data.decimal("shares")
                 current_shares += shares_added
-                current_acb_usd += Decimal(str(tax_data["total_acb_usd"]))
-                current_acb_cad = current_acb_usd * exchange_rate_dec
+                current_acb_usd += tax_data["total_acb_usd"]
+                current_acb_cad = current_acb_usd * exchange_rate
                 
-                update_spreadsheet(
+                writer.add_row(
                     vest_data, tax_data, exchange_rate,
-                    float(current_shares),
-                    float(current_acb_usd),
-                    float(current_acb_cad),
-                    output_path="stock_tracker.xlsx"
+                    current_shares,
+                    current_acb_usd,
+                    current_acb_cad
                 )
                 
                 # ------------------------------------------
                 # Part 2: Sale-to-Cover (USD-based calculation)
                 # ------------------------------------------
-                if "shares_sold" in transaction and transaction["shares_sold"] > 0:
-                    sale_data = {
-                        "type": "Sale_to_Cover",
-                        "date": transaction["date"],
-                        "shares_sold": transaction["shares_sold"],
-                        "sale_price_usd": transaction["sale_price_usd"]
-                    }
+                if transaction.shares_sold > 0:
+                    sale_data = transaction.sale_to_cover()
                     
                     # Process sale using USD ACB
                     sale_tax_data = process_sale(
                         sale_data, 
-                        float(current_shares), 
-                        float(current_acb_usd), 
+                        current_shares, 
+                        current_acb_usd, 
                         exchange_rate
                     )
                     
                     # Update tracking
-                    shares_sold = Decimal(str(sale_data["shares_sold"]))
+                    shares_sold = sale_data.decimal("shares_sold")
                     current_shares -= shares_sold
-                    current_acb_usd -= Decimal(str(sale_tax_data["acb_sold_usd"]))
-                    current_acb_cad = current_acb_usd * exchange_rate_dec
+                    current_acb_usd -= sale_tax_data["acb_sold_usd"]
+                    current_acb_cad = current_acb_usd * exchange_rate
                     
-                    update_spreadsheet(
+                    writer.add_row(
                         sale_data, sale_tax_data, exchange_rate,
-                        float(current_shares),
-                        float(current_acb_usd),
-                        float(current_acb_cad),
-                        output_path="stock_tracker.xlsx"
+                        current_shares,
+                        current_acb_usd,
+                        current_acb_cad
                     )
+                    current_acb_usd = deny_superficial_loss(
+                        superficial, sale_data, sale_tax_data, exchange_rate, writer,
+                        current_shares, current_acb_usd
+                    )
+                    current_acb_cad = current_acb_usd * exchange_rate
 
-            elif transaction["type"] == "ESPP":
+            elif transaction.type == "ESPP":
                 tax_data = calculate_tax_data(transaction, exchange_rate)
                 
                 # Update USD tracking
-                shares_added = Decimal(str(transaction["shares"]))
+                shares_added = transaction.decimal("shares")
                 current_shares += shares_added
-                current_acb_usd += Decimal(str(tax_data["total_acb_usd"]))
-                current_acb_cad = current_acb_usd * exchange_rate_dec
+                current_acb_usd += tax_data["total_acb_usd"]
+                current_acb_cad = current_acb_usd * exchange_rate
                 
-                update_spreadsheet(
+                writer.add_row(
                     transaction, 
                     tax_data, 
                     exchange_rate,
-                    float(current_shares),
-                    float(current_acb_usd),
-                    float(current_acb_cad),
-                    output_path="stock_tracker.xlsx"
+                    current_shares,
+                    current_acb_usd,
+                    current_acb_cad
                 )
                 
-            elif transaction["type"] == "Sale":
+            elif transaction.type == "Sale":
                 if current_shares <= 0:
-                    print(f"Error: No shares to sell on {transaction['date']}!")
+                    print(f"Error: No shares to sell on {transaction.date}!")
                     continue
                 
                 # Process sale using USD ACB
                 sale_tax_data = process_sale(
                     transaction, 
-                    float(current_shares), 
-                    float(current_acb_usd), 
+                    current_shares, 
+                    current_acb_usd, 
                     exchange_rate
                 )
                 
                 # Update tracking
-                shares_sold = Decimal(str(transaction["shares_sold"]))
+                shares_sold = transaction.decimal("shares_sold")
                 current_shares -= shares_sold
-                current_acb_usd -= Decimal(str(sale_tax_data["acb_sold_usd"]))
-                current_acb_cad = current_acb_usd * exchange_rate_dec
+                current_acb_usd -= sale_tax_data["acb_sold_usd"]
+                current_acb_cad = current_acb_usd * exchange_rate
                 
-                update_spreadsheet(
+                writer.add_row(
                     transaction, 
                     sale_tax_data, 
                     exchange_rate,
-                    float(current_shares),
-                    float(current_acb_usd),
-                    float(current_acb_cad),
-                    output_path="stock_tracker.xlsx"
+                    current_shares,
+                    current_acb_usd,
+                    current_acb_cad
+                )
+                current_acb_usd = deny_superficial_loss(
+                    superficial, transaction, sale_tax_data, exchange_rate, writer,
+                    current_shares, current_acb_usd
                 )
+                current_acb_cad = current_acb_usd * exchange_rate
                 
         except Exception as e:
-            print(f"Failed {transaction.get('date', 'N/A')}: {str(e)}")
+            date_str = transaction.date if isinstance(transaction, Transaction) else transaction.get("date", "N/A")
+            print(f"Failed {date_str}: {str(e)}")
 
-    create_annual_summary("stock_tracker.xlsx")
+    return current_shares, current_acb_usd, current_acb_cad
+
+def process_all_data(pdf_dir="pdfs", sales_csv="sells.csv",
+                     output_path="stock_tracker.xlsx", flush_every=None, pdf_workers=None,
+                     pdf_cache=PDF_CACHE_PATH, incremental=False,
+                     checkpoint_path=CHECKPOINT_PATH):
+    """Build the report for one set of inputs and return the final holdings.
+
+    Runs in its own Decimal context, so concurrent runs (see batch.py) never
+    share precision state.
+    """
+    with localcontext() as ctx:
+        ctx.prec = 8  # Precision for financial calculations
+        
+        # pandas/openpyxl are only loaded when a workbook is actually built
+        from spreadsheet_updater import LedgerWriter
+    
+        # Initialize tracking in both USD and CAD
+        current_shares = Decimal('0')
+        current_acb_usd = Decimal('0')
+        current_acb_cad = Decimal('0')
+    
+        # Rows are buffered and the workbook is written once at the end
+        writer = LedgerWriter(output_path, flush_every=flush_every)
+    
+        # 1. Process PDFs (RSU/ESPP), already sorted by date
+        with instrumentation.stage("pdf_ingest"):
+            pdf_records = load_pdf_transactions(pdf_dir, pdf_workers, pdf_cache)
+    
+        # 2-3. Stream the Sales CSV and merge it in by date
+        with instrumentation.stage("csv_merge"):
+            all_data = merge_transactions(pdf_records, sales_csv)
+        instrumentation.incr("transactions", len(all_data))
+    
+        # 4. Resume from the saved checkpoint when only newer transactions were added
+        start = 0
+        if incremental:
+            with instrumentation.stage("checkpoint_resume"):
+                checkpoint = load_checkpoint(checkpoint_path)
+                start = resume_index(checkpoint, all_data, output_path)
+                if start > 0:
+                    current_shares = checkpoint["shares"]
+                    current_acb_usd = checkpoint["acb_usd"]
+                    current_acb_cad = checkpoint["acb_cad"]
+                    writer.load_existing()
+                    print(f"Resuming after {checkpoint['last_date']}: {len(all_data) - start} new transactions")
+        instrumentation.incr("transactions_processed", len(all_data) - start)
+    
+        # 5. Prefetch FX rates for the whole date span in one go. The index
+        # spans the whole ledger even when resuming (months already processed
+        # come from the rate store), or covers recent rates for an empty
+        # ledger, so callers such as simulator.rates_for_dates always get one.
+        with instrumentation.stage("fx_prefetch"):
+            if all_data:
+                rate_index = prefetch_exchange_rates(all_data[0].date, all_data[-1].date)
+            else:
+                today = date.today().strftime("%m-%d-%Y")
+                rate_index = prefetch_exchange_rates(today, today)
+    
+        # 6. Process transactions with USD-first tracking. The acquisition index
+        # covers the whole ledger, since a sale's window reaches 30 days either way.
+        with instrumentation.stage("tax_math"):
+            superficial = AcquisitionIndex(all_data)
+            current_shares, current_acb_usd, current_acb_cad = process_transactions(
+                all_data[start:], rate_index, writer,
+                current_shares, current_acb_usd, current_acb_cad, superficial
+            )
+
+        # 7. Write Transactions and Annual Summary
+        writer.close()
+        with instrumentation.stage("state_log_save"):
+            save_state_log(state_log_path(output_path), writer.rows)
+        with instrumentation.stage("checkpoint_save"):
+            save_checkpoint(all_data, current_shares, current_acb_usd, current_acb_cad,
+                            output_path, checkpoint_path, last_loss_date(writer.rows))
+    
+        return {
+            "transactions": len(all_data),
+            "shares": current_shares,
+            "acb_usd": current_acb_usd,
+            "acb_cad": current_acb_cad,
+            # Rates for the ledger's date span, reusable by simulator.rates_for_dates
+            "rate_index": rate_index,
+        }
+
+def print_state(ledger_path, date_str=None):
+    """Print shares held and ACB from a saved state log, without loading pandas."""
+    state = state_as_of(ledger_path, date_str)
+    when = f"as of {date_str}" if date_str else "currently"
+    if state is None:
+        print(f"No shares held {when}")
+        return
+    print(f"Shares held {when} (last transaction {state['date']}): {state['shares']:.4f}")
+    print(f"ACB (USD): {state['acb_usd']:.2f} ({state['acb_per_share_usd']:.4f} per share)")
+    print(f"ACB (CAD): {state['acb_cad']:.2f}")
+
+def print_year(ledger_path, year):
+    """Print one tax year's opening/closing holdings and sales from a saved state log."""
+    summary = year_summary(ledger_path, year)
+    for label in ("opening", "closing"):
+        state = summary[label]
+        shares = state["shares"] if state else 0.0
+        acb_usd = state["acb_usd"] if state else 0.0
+        acb_cad = state["acb_cad"] if state else 0.0
+        print(f"{year} {label}: {shares:.4f} shares, ACB {acb_usd:.2f} USD / {acb_cad:.2f} CAD")
+    if not summary["periods"]:
+        print(f"No sales in {year}")
+    for period in summary["periods"]:
+        print(f"{period['period']}: proceeds {period['proceeds_cad']:.2f} CAD, "
+              f"cost basis {period['cost_basis_cad']:.2f} CAD, "
+              f"gain/loss {period['capital_gain_loss_cad']:.2f} CAD "
+              f"({period['capital_gain_loss_usd']:.2f} USD), "
+              f"taxable at {period['inclusion_rate']:g} {period['taxable_capital_gain_cad']:.2f} CAD")
 
 if __name__ == "__main__":
-    process_all_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the RSU/ESPP tax report.")
+    parser.add_argument("--pdf-dir", default="pdfs")
+    parser.add_argument("--sales-csv", default="sells.csv")
+    parser.add_argument("--output", default="stock_tracker.xlsx")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used to parse PDFs (default: CPU count)")
+    parser.add_argument("--no-pdf-cache", action="store_true",
+                        help="re-parse every PDF instead of reusing cached results")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only process transactions newer than the saved checkpoint")
+    parser.add_argument("--report", metavar="PATH",
+                        help="write per-stage timings and counters to PATH as JSON")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="write a cProfile dump of the run to PATH")
+    subparsers = parser.add_subparsers(dest="command")
+    query_parser = subparsers.add_parser("query", help="show shares held and ACB from the saved ledger")
+    query_parser.add_argument("--date", help="MM-DD-YYYY (default: after the last transaction)")
+    query_parser.add_argument("--year", type=int, help="summarize one tax year instead")
+    query_parser.add_argument("--ledger", help="state log to read (default: next to --output)")
+    args = parser.parse_args()
+
+    if args.command == "query":
+        if args.year:
+            print_year(args.ledger or state_log_path(args.output), args.year)
+        else:
+            print_state(args.ledger or state_log_path(args.output), args.date)
+        raise SystemExit(0)
+
+    report = instrumentation.start_report() if args.report else None
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        process_all_data(args.pdf_dir, args.sales_csv, args.output, pdf_workers=args.workers,
+                         pdf_cache=None if args.no_pdf_cache else PDF_CACHE_PATH,
+                         incremental=args.incremental)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if report:
+            instrumentation.stop_report().save(args.report)
@@ -1,46 +1,279 @@
-import pdfplumber
+import hashlib
+import json
+import os
 import re
+import instrumentation
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump whenever the extraction regexes or the shape of the returned records
+# change, so cached parses from older versions are thrown away
+PARSER_VERSION = 3
+PDF_CACHE_PATH = "pdf_cache.json"
+
+RSU_HEADER = "EMPLOYEE STOCK PLAN RELEASE CONFIRMATION"
+ESPP_HEADER = "EMPLOYEE STOCK PLAN PURCHASE CONFIRMATION"
+
+# One alternation per document type, so every field is found in a single scan.
+# Each group is named after the record key it fills. Words are joined by \s+
+# because raw text may break a label across lines.
+RSU_PATTERN = re.compile(
+    r"Release\s+Date\s+(?P<date>\d{2}-\d{2}-\d{4})"
+    r"|Shares\s+Released\s+(?P<shares_vested>[\d.]+)"
+    r"|Market\s+Value\s+Per\s+Share\s+\$(?P<fmv_usd>[\d.]+)"
+    r"|Shares\s+Sold\s+\((?P<shares_sold>[\d.]+)\)"
+    r"|Sale\s+Price\s+Per\s+Share\s+\$(?P<sale_price_usd>[\d.]+)"
+)
+ESPP_PATTERN = re.compile(
+    r"Purchase\s+Date\s+(?P<date>\d{2}-\d{2}-\d{4})"
+    r"|Shares\s+Purchased\s+(?P<shares>[\d.]+)"
+    r"|Purchase\s+Value\s+per\s+Share\s+\$(?P<fmv_usd>[\d.]+)"
+    r"|\(\d+\.\d+%\s+of\s+\$[\d.]+\)\s+\$(?P<purchase_price_usd>[\d.]+)"
+)
+
+# Label printed next to each field, for error messages
+FIELD_LABELS = {
+    "RSU": {"date": "Release Date", "shares_vested": "Shares Released",
+            "fmv_usd": "Market Value Per Share", "shares_sold": "Shares Sold",
+            "sale_price_usd": "Sale Price Per Share"},
+    "ESPP": {"date": "Purchase Date", "shares": "Shares Purchased",
+             "fmv_usd": "Purchase Value per Share", "purchase_price_usd": "Purchase Price per Share"},
+}
+# Fields every grant has; the sell-to-cover fields of a release are optional
+REQUIRED_FIELDS = {
+    "RSU": ("date", "shares_vested", "fmv_usd"),
+    "ESPP": ("date", "shares", "fmv_usd", "purchase_price_usd"),
+}
+
+_raw_text_device = None
+
+def _raw_text_device_class():
+    """pdfminer device that keeps only the decoded text of each text-showing operator.
+
+    Skips the per-character boxes and layout pdfplumber builds, which is most
+    of its cost on these short confirmations. Built on first use since
+    pdfminer is imported lazily.
+    """
+    global _raw_text_device
+    if _raw_text_device is not None:
+        return _raw_text_device
+    from pdfminer.pdfdevice import PDFDevice
+    from pdfminer.pdffont import PDFUnicodeNotDefined
+
+    class RawTextDevice(PDFDevice):
+        def __init__(self, rsrcmgr):
+            super().__init__(rsrcmgr)
+            self.chunks = []
+
+        def render_string(self, textstate, seq, ncs, graphicstate):
+            font = textstate.font
+            chars = []
+            for obj in seq:
+                if isinstance(obj, bytes):
+                    for cid in font.decode(obj):
+                        try:
+                            chars.append(font.to_unichr(cid))
+                        except PDFUnicodeNotDefined:
+                            pass
+                elif obj < -200:
+                    # A large TJ adjustment is a visual word gap
+                    chars.append(" ")
+            self.chunks.append("".join(chars))
+
+    _raw_text_device = RawTextDevice
+    return _raw_text_device
+
+def raw_page_texts(pdf_path):
+    """Yield each page's text in content-stream order, without layout analysis."""
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    rsrcmgr = PDFResourceManager(caching=True)
+    with open(pdf_path, "rb") as f:
+        for page in PDFPage.get_pages(f):
+            device = _raw_text_device_class()(rsrcmgr)
+            PDFPageInterpreter(rsrcmgr, device).process_page(page)
+            yield "\n".join(device.chunks)
+
+def layout_page_texts(pdf_path):
+    """Each page's text as laid out by pdfplumber; slower but reading-order safe."""
+    # Imported here so commands that never touch PDFs skip loading pdfplumber
+    import pdfplumber
 
-def extract_pdf_data(pdf_path):
     with pdfplumber.open(pdf_path) as pdf:
-        text = pdf.pages[0].extract_text()
-        
-        if "EMPLOYEE STOCK PLAN RELEASE CONFIRMATION" in text:
-            return extract_rsu_data(text)
-        elif "EMPLOYEE STOCK PLAN PURCHASE CONFIRMATION" in text:
-            return extract_espp_data(text)
-        else:
-            raise ValueError("Unsupported PDF type")
+        return [page.extract_text() or "" for page in pdf.pages]
+
+def _document_type(text):
+    if RSU_HEADER in text:
+        return "RSU"
+    if ESPP_HEADER in text:
+        return "ESPP"
+    return None
+
+def _extract_raw(pdf_path):
+    # Records from the raw page text, or None if the first page is not a confirmation
+    pages = raw_page_texts(pdf_path)
+    try:
+        first_page = next(pages, "")
+        doc_type = _document_type(first_page)
+        if doc_type is None:
+            return None
+        return extract_records(doc_type, "\n".join([first_page, *pages]))
+    finally:
+        # Closes the file even when the scan stops after the first page
+        pages.close()
+
+def extract_pdf_data(pdf_path):
+    """Parse one confirmation PDF into a list of records, one per grant.
+
+    The first page's raw text identifies the document; all pages are then
+    scanned once. Falls back to pdfplumber's laid-out text when the raw text
+    does not read cleanly (unusual encodings or content order) or the raw
+    pdfminer pass fails outright.
+    """
+    try:
+        records = _extract_raw(pdf_path)
+        if records is not None:
+            return records
+    except Exception:
+        # Missing fields, pdfminer syntax errors or changes in the pdfminer
+        # internals the raw pass relies on: let pdfplumber try the file instead
+        pass
+
+    text = "\n".join(layout_page_texts(pdf_path))
+    doc_type = _document_type(text)
+    if doc_type is None:
+        raise ValueError("Unsupported PDF type")
+    return extract_records(doc_type, text)
+
+def extract_records(doc_type, text):
+    """Pull every grant's fields out of a confirmation's text in one regex scan.
+
+    Only the date starts a new grant, and only once the current grant has all
+    its required fields; a date repeated by a page header is otherwise
+    ignored. Within a grant the first value of each field wins, so labels
+    repeated in summaries or totals are ignored. Raises ValueError naming the
+    first required field a grant is missing.
+    """
+    pattern = RSU_PATTERN if doc_type == "RSU" else ESPP_PATTERN
+    required = REQUIRED_FIELDS[doc_type]
+    records = []
+    current = None
+    for match in pattern.finditer(text):
+        field = match.lastgroup
+        value = match.group(field)
+        if current is None or (field == "date" and "date" in current
+                               and (value != current["date"]
+                                    or all(key in current for key in required))):
+            current = {"type": doc_type}
+            records.append(current)
+        if field not in current:
+            current[field] = value if field == "date" else float(value)
+
+    # A header repeated after the last grant leaves a grant holding only its date
+    records = [record for i, record in enumerate(records)
+               if len(record) > 2 or all(other.get("date") != record.get("date") for other in records[:i])]
+    if not records:
+        raise ValueError(f"No {doc_type} grants found")
+    for number, record in enumerate(records, 1):
+        _check_fields(record, number)
+    return records
+
+def _check_fields(record, number):
+    labels = FIELD_LABELS[record["type"]]
+    if record["type"] == "RSU":
+        # A release with no sell-to-cover has neither sale field
+        record.setdefault("shares_sold", 0.0)
+        if record["shares_sold"] == 0.0:
+            record.setdefault("sale_price_usd", 0.0)
+    for field, label in labels.items():
+        if field not in record:
+            raise ValueError(f"{record['type']} grant {number} is missing {label}")
 
 def extract_rsu_data(text):
-    data = {"type": "RSU"}
-    
-    # Extract Release Date
-    date_match = re.search(r"Release Date\s+(\d{2}-\d{2}-\d{4})", text)
-    data["date"] = date_match.group(1) if date_match else None
-    
-    # Extract Shares Released (Vested)
-    shares_vested_match = re.search(r"Shares Released\s+([\d.]+)", text)
-    data["shares_vested"] = float(shares_vested_match.group(1)) if shares_vested_match else 0.0
-    
-    # Extract FMV per Share
-    fmv_match = re.search(r"Market Value Per Share\s+\$([\d.]+)", text)
-    data["fmv_usd"] = float(fmv_match.group(1)) if fmv_match else 0.0
-    
-    # Extract Shares Sold (for taxes)
-    shares_sold_match = re.search(r"Shares Sold\s+\(([\d.]+)\)", text)
-    data["shares_sold"] = float(shares_sold_match.group(1)) if shares_sold_match else 0.0
-    
-    # Extract Sale Price per Share (for sell-to-cover)
-    sale_price_match = re.search(r"Sale Price Per Share\s+\$([\d.]+)", text)
-    data["sale_price_usd"] = float(sale_price_match.group(1)) if sale_price_match else 0.0
-    
-    return data
+    return extract_records("RSU", text)
 
 def extract_espp_data(text):
-    data = {"type": "ESPP"}
-    data["date"] = re.search(r"Purchase Date\s+(\d{2}-\d{2}-\d{4})", text).group(1)
-    data["shares"] = float(re.search(r"Shares Purchased\s+([\d.]+)", text).group(1))
-    data["fmv_usd"] = float(re.search(r"Purchase Value per Share\s+\$([\d.]+)", text).group(1))
-    data["purchase_price_usd"] = float(re.search(r"\((\d+\.\d+)% of \$[\d.]+\)\s+\$([\d.]+)", text).group(2))
-    return data
\ No newline at end of file
+    return extract_records("ESPP", text)
+
+def _extract_safe(pdf_path):
+    # Runs in worker processes: hand back the error text rather than raising,
+    # since not every pdfplumber exception survives pickling
+    try:
+        return extract_pdf_data(pdf_path), None
+    except Exception as e:
+        return None, str(e)
+
+def file_digest(path):
+    """SHA-256 of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_parse_cache(cache_path):
+    """Load cached parses ({digest: data}), dropping them on a parser version change."""
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if cache.get("parser_version") != PARSER_VERSION:
+        return {}
+    return cache.get("entries", {})
+
+def save_parse_cache(cache_path, entries):
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"parser_version": PARSER_VERSION, "entries": entries}, f)
+    os.replace(tmp_path, cache_path)
+
+def extract_pdf_dir(pdf_dir, workers=None, cache_path=PDF_CACHE_PATH):
+    """Parse every PDF in pdf_dir, spreading the work over a process pool.
+
+    workers defaults to the CPU count; 1 parses in-process. Parses are cached
+    in cache_path by file content hash, so only new or changed PDFs go through
+    pdfplumber; pass cache_path=None to disable the cache. Returns
+    (records, failures) in filename order, where records has one dict per
+    grant (a PDF may hold several) and failures holds
+    (filename, error message) pairs.
+    """
+    filenames = sorted(f for f in os.listdir(pdf_dir) if f.endswith(".pdf"))
+    paths = [os.path.join(pdf_dir, f) for f in filenames]
+    workers = workers or os.cpu_count() or 1
+
+    cache = load_parse_cache(cache_path) if cache_path else {}
+    digests = [file_digest(path) for path in paths] if cache_path else [None] * len(paths)
+    results = [(cache[digest], None) if digest in cache else None for digest in digests]
+    pending = [i for i, result in enumerate(results) if result is None]
+    pending_paths = [paths[i] for i in pending]
+
+    if workers > 1 and len(pending_paths) > 1:
+        workers = min(workers, len(pending_paths))
+        chunksize = max(1, len(pending_paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(_extract_safe, pending_paths, chunksize=chunksize))
+    else:
+        parsed = [_extract_safe(path) for path in pending_paths]
+
+    for i, result in zip(pending, parsed):
+        results[i] = result
+        # Failures are not cached so a fixed parser or file is retried next run
+        if cache_path and result[1] is None:
+            cache[digests[i]] = result[0]
+
+    if cache_path and any(result[1] is None for result in parsed):
+        save_parse_cache(cache_path, cache)
+
+    instrumentation.incr("pdfs_cached", len(paths) - len(pending))
+    instrumentation.incr("pdfs_parsed", sum(1 for result in parsed if result[1] is None))
+    instrumentation.incr("pdfs_failed", sum(1 for result in parsed if result[1] is not None))
+
+    records = []
+    failures = []
+    for filename, (data, error) in zip(filenames, results):
+        if error is None:
+            records.extend(data)
+        else:
+            failures.append((filename, error))
+    return records, failures
@@ -0,0 +1,142 @@
+from array import array
+from dataclasses import dataclass
+from datetime import date
+from decimal import Context, Decimal
+
+# Share counts and USD amounts are stored as integer micro-units
+MICRO = 1_000_000
+# Wide enough that turning micro-units back into a Decimal never rounds
+_EXACT = Context(prec=38)
+
+TYPES = ("RSU", "ESPP", "Sale", "RSU_Vest", "Sale_to_Cover", "Superficial_Loss")
+_TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+
+# Parser dict key -> attribute holding it, per transaction type
+_KEYS = {
+    "RSU": {"shares_vested": "shares", "fmv_usd": "fmv",
+            "shares_sold": "shares_sold", "sale_price_usd": "sale_price"},
+    "ESPP": {"shares": "shares", "fmv_usd": "fmv", "purchase_price_usd": "purchase_price"},
+    "Sale": {"shares_sold": "shares_sold", "sale_price_usd": "sale_price"},
+    "RSU_Vest": {"shares": "shares", "fmv_usd": "fmv"},
+    "Sale_to_Cover": {"shares_sold": "shares_sold", "sale_price_usd": "sale_price"},
+    "Superficial_Loss": {},
+}
+# Keys a parser dict may leave out: an RSU release without a sell-to-cover
+_OPTIONAL_KEYS = {"RSU": ("shares_sold", "sale_price_usd")}
+
+def date_ordinal(date_str):
+    """MM-DD-YYYY -> proleptic Gregorian ordinal, for cheap date comparisons."""
+    return date(int(date_str[6:10]), int(date_str[0:2]), int(date_str[3:5])).toordinal()
+
+def format_ordinal(ordinal):
+    """Proleptic Gregorian ordinal -> MM-DD-YYYY."""
+    d = date.fromordinal(ordinal)
+    return f"{d.month:02d}-{d.day:02d}-{d.year:04d}"
+
+def to_micro(value):
+    return round(float(value) * MICRO)
+
+@dataclass(slots=True)
+class Transaction:
+    """One ledger event with an integer date and fixed-point amounts.
+
+    ordinal is the date as a proleptic Gregorian ordinal. shares and
+    shares_sold are micro-shares; fmv, purchase_price and sale_price are
+    micro-USD per share; decimal() gives their exact value.
+    """
+    type: str
+    ordinal: int
+    shares: int = 0
+    shares_sold: int = 0
+    fmv: int = 0
+    purchase_price: int = 0
+    sale_price: int = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a Transaction from a parser dict (MM-DD-YYYY date, float fields).
+
+        Raises KeyError when a field the type requires is missing.
+        """
+        optional = _OPTIONAL_KEYS.get(data["type"], ())
+        for key in _KEYS[data["type"]]:
+            if key not in data and key not in optional:
+                raise KeyError(f"Missing '{key}' in {data['type']} transaction dated {data.get('date')}")
+        attrs = {attr: to_micro(data[key]) for key, attr in _KEYS[data["type"]].items() if key in data}
+        ordinal = data["ordinal"] if "ordinal" in data else date_ordinal(data["date"])
+        return cls(data["type"], ordinal, **attrs)
+
+    @property
+    def date(self):
+        return format_ordinal(self.ordinal)
+
+    def decimal(self, attr):
+        """Exact Decimal value of an amount attribute, e.g. "fmv"."""
+        return Decimal(getattr(self, attr)).scaleb(-6, _EXACT)
+
+    def to_dict(self):
+        """The parser dict this Transaction is built from (MM-DD-YYYY date, float fields)."""
+        data = {"type": self.type, "date": self.date, "ordinal": self.ordinal}
+        for key, attr in _KEYS[self.type].items():
+            data[key] = getattr(self, attr) / MICRO
+        return data
+
+    def vest(self):
+        """The RSU_Vest half of an RSU release."""
+        return Transaction("RSU_Vest", self.ordinal, shares=self.shares, fmv=self.fmv)
+
+    def sale_to_cover(self):
+        """The Sale_to_Cover half of an RSU release."""
+        return Transaction("Sale_to_Cover", self.ordinal, shares_sold=self.shares_sold,
+                           sale_price=self.sale_price)
+
+class Ledger:
+    """Array-backed sequence of Transactions for bulk use.
+
+    Each field is one typed array column (about 50 bytes per event instead of
+    a dict per event). Indexing builds a Transaction on the fly; slicing
+    returns a new Ledger.
+    """
+
+    __slots__ = ("types", "ordinal", "shares", "shares_sold", "fmv", "purchase_price", "sale_price")
+    _COLUMNS = ("ordinal", "shares", "shares_sold", "fmv", "purchase_price", "sale_price")
+
+    def __init__(self, records=()):
+        self.types = array("b")
+        for column in self._COLUMNS:
+            setattr(self, column, array("q"))
+        self.extend(records)
+
+    def append(self, transaction):
+        self.types.append(_TYPE_CODES[transaction.type])
+        for column in self._COLUMNS:
+            getattr(self, column).append(getattr(transaction, column))
+
+    def extend(self, records):
+        for transaction in records:
+            self.append(transaction)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ledger = Ledger()
+            ledger.types = self.types[index]
+            for column in self._COLUMNS:
+                setattr(ledger, column, getattr(self, column)[index])
+            return ledger
+        return Transaction(TYPES[self.types[index]],
+                           *(getattr(self, column)[index] for column in self._COLUMNS))
+
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield self[i]
+
+    def to_numpy(self):
+        """The columns as NumPy arrays (types as int8 codes into TYPES), without copying."""
+        import numpy as np
+        columns = {"types": np.frombuffer(self.types, dtype=np.int8)}
+        for column in self._COLUMNS:
+            columns[column] = np.frombuffer(getattr(self, column), dtype=np.int64)
+        return columns
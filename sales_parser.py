@@ -1,19 +1,48 @@
 import csv
-from datetime import datetime
+import heapq
+from datetime import date
+from records import Transaction, to_micro
 
-def parse_sales_csv(csv_path):
-    sales = []
-    with open(csv_path, 'r') as f:
+class UnsortedSalesError(ValueError):
+    """A sales stream was not in ascending date order, so it cannot be merged as-is."""
+
+def iter_sales_csv(csv_path):
+    """Stream Sale Transactions from a brokerage trade export, one row at a time.
+
+    Rows whose Transaction is not "Order Executed" (dividends, transfers, ...)
+    are skipped. Dates are parsed once here into the record's ordinal.
+    """
+    with open(csv_path, 'r', newline='') as f:
         reader = csv.DictReader(f)
         for row in reader:
-            # Extract date (MM/DD/YYYY → MM-DD-YYYY)
-            date_str = row['Date & Time'].split()[0]
-            date = datetime.strptime(date_str, "%m/%d/%Y").strftime("%m-%d-%Y")
-            
-            sales.append({
-                "type": "Sale",
-                "date": date,
-                "shares_sold": float(row["Sale Quantity"]),
-                "sale_price_usd": float(row["Price"])
-            })
-    return sales
\ No newline at end of file
+            if row.get("Transaction", "Order Executed").strip() != "Order Executed":
+                continue
+
+            # Extract date (MM/DD/YYYY)
+            month, day, year = row['Date & Time'].split()[0].split("/")
+
+            yield Transaction(
+                "Sale",
+                date(int(year), int(month), int(day)).toordinal(),
+                shares_sold=to_micro(row["Sale Quantity"]),
+                sale_price=to_micro(row["Price"])
+            )
+
+def parse_sales_csv(csv_path):
+    return list(iter_sales_csv(csv_path))
+
+def _ensure_sorted(records):
+    last = None
+    for record in records:
+        if last is not None and record.ordinal < last:
+            raise UnsortedSalesError(f"Records are not in ascending date order at {record.date}")
+        last = record.ordinal
+        yield record
+
+def merge_by_date(*streams):
+    """Lazily k-way merge date-sorted Transaction streams on their ordinal.
+
+    Records with the same date keep the order of the streams they came from.
+    Raises UnsortedSalesError if a stream turns out not to be sorted.
+    """
+    return heapq.merge(*map(_ensure_sorted, streams), key=lambda record: record.ordinal)
@@ -0,0 +1,82 @@
+import argparse
+import time
+from datetime import date
+from decimal import Decimal
+import numpy as np
+from records import date_ordinal
+
+def rates_for_dates(dates, rate_index, fallback_rate=None):
+    """FX rates for MM-DD-YYYY dates from a RateIndex (e.g. process_all_data's).
+
+    Future dates have no published rate: they get fallback_rate (an assumed
+    rate for a planned sale), or raise ValueError if none is given.
+    """
+    today = date.today().toordinal()
+    rates = []
+    for date_str in dates:
+        if date_ordinal(date_str) <= today:
+            rates.append(rate_index.lookup(date_str))
+        elif fallback_rate is not None:
+            rates.append(fallback_rate)
+        else:
+            raise ValueError(f"No exchange rate is published for {date_str} yet; "
+                             "pass fallback_rate to assume one for future dates")
+    return np.array(rates, dtype=float)
+
+def simulate_sales(holdings, prices, quantities, rates):
+    """Evaluate every price x quantity x FX-rate combination of a hypothetical sale.
+
+    holdings is the dict returned by process_all_data (or anything with
+    "shares" and "acb_usd"). Uses the same average-cost math as process_sale,
+    as one broadcast array computation with no file I/O. Each result has shape
+    (len(prices), len(quantities), len(rates)); scenarios selling more shares
+    than are held are marked infeasible and their amounts are NaN.
+    """
+    shares = float(holdings["shares"])
+    acb_usd = float(holdings["acb_usd"])
+    acb_per_share_usd = acb_usd / shares if shares > 0 else 0.0
+
+    price = np.asarray(prices, dtype=float)[:, None, None]
+    quantity = np.abs(np.asarray(quantities, dtype=float))[None, :, None]
+    rate = np.asarray(rates, dtype=float)[None, None, :]
+    shape = (price.shape[0], quantity.shape[1], rate.shape[2])
+
+    feasible = np.broadcast_to((quantity > 0) & (quantity <= shares), shape)
+    proceeds_usd = quantity * price
+    acb_sold_usd = quantity * acb_per_share_usd
+    capital_gain_loss_usd = proceeds_usd - acb_sold_usd
+
+    # Average cost: the shares left keep the same per-share ACB, until none are left
+    shares_remaining = shares - quantity
+    acb_after_usd = np.where(shares_remaining > 0, acb_per_share_usd, 0.0)
+
+    def masked(values):
+        return np.where(feasible, np.broadcast_to(values, shape), np.nan)
+
+    return {
+        "feasible": feasible,
+        "proceeds_cad": masked(proceeds_usd * rate),
+        "acb_sold_cad": masked(acb_sold_usd * rate),
+        "capital_gain_loss_usd": masked(capital_gain_loss_usd),
+        "capital_gain_loss_cad": masked(capital_gain_loss_usd * rate),
+        "shares_remaining": masked(shares_remaining),
+        "acb_per_share_usd": masked(acb_after_usd),
+        "acb_per_share_cad": masked(acb_after_usd * rate),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the what-if sale simulator.")
+    parser.add_argument("--prices", type=int, default=100)
+    parser.add_argument("--quantities", type=int, default=20)
+    parser.add_argument("--rates", type=int, default=5)
+    args = parser.parse_args()
+
+    holdings = {"shares": Decimal("1250.5"), "acb_usd": Decimal("98765.43")}
+    prices = np.round(np.linspace(40, 200, args.prices), 2)
+    quantities = np.linspace(10, 1300, args.quantities).round()
+    rates = np.round(np.linspace(1.25, 1.45, args.rates), 4)
+
+    start = time.perf_counter()
+    result = simulate_sales(holdings, prices, quantities, rates)
+    scenarios = result["feasible"].size
+    print(f"simulate_sales on {scenarios} scenarios: {(time.perf_counter() - start) * 1000:.1f} ms")
@@ -1,7 +1,9 @@
 import os
 import pandas as pd
-from openpyxl import load_workbook
 import numpy as np
+import instrumentation
+from records import MICRO
+from tax_periods import get_calendar
 
 # Updated column list with new USD fields
 COLUMNS = [
@@ -9,144 +11,234 @@ COLUMNS = [
     "Purchase Price (USD)", "Purchase Price (CAD)", "Sale Price (USD)",
     "Sale Price (CAD)", "Exchange Rate", "Taxable Income (CAD)",
     "ACB Impact (USD)", "ACB Impact (CAD)", "ACB Remaining (USD)",
-    "ACB Remaining (CAD)", "ACB per share (USD)", "Capital Gain/Loss (CAD)", 
+    "ACB Remaining (CAD)", "ACB per share (USD)", "Capital Gain/Loss (CAD)",
     "Capital Gain/Loss (USD)", "Shares Remaining"
 ]
 
-def update_spreadsheet(data, tax_data, exchange_rate, shares_remaining, 
-                      acb_remaining_usd, acb_remaining_cad, output_path="stock_tracker.xlsx"):
-    """Update Transactions sheet with USD-based ACB tracking."""
-    try:
-        df = pd.read_excel(output_path, sheet_name="Transactions", engine="openpyxl")
-    except (FileNotFoundError, ValueError):
-        df = pd.DataFrame(columns=COLUMNS)
+SUMMARY_COLUMNS = [
+    "Year", "Period",
+    "Proceeds_USD", "Proceeds_CAD",
+    "Cost_Basis_USD", "Cost_Basis_CAD",
+    "Capital_Gain_Loss_USD", "Capital_Gain_Loss_CAD",
+    "Inclusion_Rate", "Taxable_Capital_Gain_CAD"
+]
+
+def build_row(data, tax_data, exchange_rate, shares_remaining,
+              acb_remaining_usd, acb_remaining_cad):
+    """Build one Transactions row with USD-based ACB tracking.
+
+    data is a Transaction; the Decimal amounts and totals are turned into
+    floats here, once per row.
+    """
+    exchange_rate = float(exchange_rate)
+    shares_remaining = float(shares_remaining)
+    acb_remaining_usd = float(acb_remaining_usd)
 
     # New row template
     new_row = {
-        "Date": data["date"],
-        "Type": data["type"],
+        "Date": data.date,
+        "Type": data.type,
         "Exchange Rate": exchange_rate,
         "Shares Remaining": shares_remaining,
         "ACB Remaining (USD)": acb_remaining_usd,
-        "ACB Remaining (CAD)": acb_remaining_cad,
+        "ACB Remaining (CAD)": float(acb_remaining_cad),
         "ACB per share (USD)": (acb_remaining_usd / shares_remaining) if shares_remaining else 0,
-        "Capital Gain/Loss (USD)": tax_data.get("capital_gain_loss_usd", 0.0),
-        "Capital Gain/Loss (CAD)": tax_data.get("capital_gain_loss", 0.0)
+        "Capital Gain/Loss (USD)": float(tax_data.get("capital_gain_loss_usd", 0.0)),
+        "Capital Gain/Loss (CAD)": float(tax_data.get("capital_gain_loss", 0.0))
     }
 
     # Transaction type handling
-    if data["type"] == "RSU_Vest":
+    if data.type == "RSU_Vest":
+        new_row.update({
+            "Shares Added/Sold": data.shares / MICRO,
+            "FMV (USD)": data.fmv / MICRO,
+            "FMV (CAD)": data.fmv / MICRO * exchange_rate,
+            "Taxable Income (CAD)": float(tax_data["taxable_income_cad"]),
+            "ACB Impact (USD)": float(tax_data["total_acb_usd"]),
+            "ACB Impact (CAD)": float(tax_data["total_acb_cad"])
+        })
+    elif data.type == "ESPP":
         new_row.update({
-            "Shares Added/Sold": data["shares"],
-            "FMV (USD)": data["fmv_usd"],
-            "FMV (CAD)": data["fmv_usd"] * exchange_rate,
-            "Taxable Income (CAD)": tax_data["taxable_income_cad"],
-            "ACB Impact (USD)": tax_data["total_acb_usd"],
-            "ACB Impact (CAD)": tax_data["total_acb_cad"]
+            "Shares Added/Sold": data.shares / MICRO,
+            "FMV (USD)": data.fmv / MICRO,
+            "FMV (CAD)": data.fmv / MICRO * exchange_rate,
+            "Purchase Price (USD)": data.purchase_price / MICRO,
+            "Purchase Price (CAD)": data.purchase_price / MICRO * exchange_rate,
+            "Taxable Income (CAD)": float(tax_data["taxable_income_cad"]),
+            "ACB Impact (USD)": float(tax_data["total_acb_usd"]),
+            "ACB Impact (CAD)": float(tax_data["total_acb_cad"])
         })
-    elif data["type"] == "ESPP":
+    elif data.type in ["Sale", "Sale_to_Cover"]:
         new_row.update({
-            "Shares Added/Sold": data["shares"],
-            "FMV (USD)": data["fmv_usd"],
-            "FMV (CAD)": data["fmv_usd"] * exchange_rate,
-            "Purchase Price (USD)": data["purchase_price_usd"],
-            "Purchase Price (CAD)": data["purchase_price_usd"] * exchange_rate,
-            "Taxable Income (CAD)": tax_data["taxable_income_cad"],
-            "ACB Impact (USD)": tax_data["total_acb_usd"],
-            "ACB Impact (CAD)": tax_data["total_acb_cad"]
+            "Shares Added/Sold": -data.shares_sold / MICRO,
+            "Sale Price (USD)": data.sale_price / MICRO,
+            "Sale Price (CAD)": data.sale_price / MICRO * exchange_rate,
+            "ACB Impact (USD)": -float(tax_data["acb_sold_usd"]),
+            "ACB Impact (CAD)": -float(tax_data["acb_sold_cad"])
         })
-    elif data["type"] in ["Sale", "Sale_to_Cover"]:
+    elif data.type == "Superficial_Loss":
         new_row.update({
-            "Shares Added/Sold": -data["shares_sold"],
-            "Sale Price (USD)": data["sale_price_usd"],
-            "Sale Price (CAD)": data["sale_price_usd"] * exchange_rate,
-            "ACB Impact (USD)": -tax_data["acb_sold_usd"],
-            "ACB Impact (CAD)": -tax_data["acb_sold_cad"]
+            "Shares Added/Sold": 0.0,
+            "ACB Impact (USD)": float(tax_data["total_acb_usd"]),
+            "ACB Impact (CAD)": float(tax_data["total_acb_cad"])
         })
 
+    return new_row
+
+def update_spreadsheet(data, tax_data, exchange_rate, shares_remaining,
+                      acb_remaining_usd, acb_remaining_cad, output_path="stock_tracker.xlsx"):
+    """Append a single row to the Transactions sheet on disk.
+
+    Re-reads and rewrites the whole sheet, so prefer LedgerWriter for full runs.
+    """
+    try:
+        df = pd.read_excel(output_path, sheet_name="Transactions", engine="openpyxl")
+    except (FileNotFoundError, ValueError):
+        df = pd.DataFrame(columns=COLUMNS)
+
+    new_row = build_row(data, tax_data, exchange_rate, shares_remaining,
+                        acb_remaining_usd, acb_remaining_cad)
     df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    
+
     # Save with proper Excel formatting
     mode = "a" if os.path.exists(output_path) else "w"
     with pd.ExcelWriter(output_path, engine="openpyxl", mode=mode,
                        if_sheet_exists="replace" if mode == "a" else None) as writer:
         df.to_excel(writer, sheet_name="Transactions", index=False)
 
-def create_annual_summary(output_path="stock_tracker.xlsx"):
-    """Generate Annual Summary with 2024 split into two periods."""
-    if not os.path.exists(output_path):
+class LedgerWriter:
+    """Buffer Transactions rows in memory and write the workbook once.
+
+    Rows are added as the ledger is processed; close() writes the Transactions
+    and Annual Summary sheets in a single pass. With flush_every set, the
+    Transactions sheet is also rewritten every flush_every rows so a very long
+    run leaves a partial workbook behind if it is interrupted.
+    """
+
+    def __init__(self, output_path="stock_tracker.xlsx", flush_every=None):
+        self.output_path = output_path
+        self.flush_every = flush_every
+        self.rows = []
+        self._unflushed = 0
+
+    def load_existing(self):
+        """Seed the buffer with the Transactions rows already in the workbook."""
+        df = pd.read_excel(self.output_path, sheet_name="Transactions", engine="openpyxl")
+        self.rows = df.to_dict("records")
+
+    def add_row(self, data, tax_data, exchange_rate, shares_remaining,
+                acb_remaining_usd, acb_remaining_cad):
+        self.rows.append(build_row(data, tax_data, exchange_rate, shares_remaining,
+                                   acb_remaining_usd, acb_remaining_cad))
+        self._unflushed += 1
+        if self.flush_every and self._unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write the rows buffered so far to the Transactions sheet."""
+        write_workbook(self.output_path, self.rows, with_summary=False)
+        self._unflushed = 0
+
+    def close(self):
+        """Write Transactions and Annual Summary in one pass."""
+        write_workbook(self.output_path, self.rows)
+        self._unflushed = 0
+
+def write_workbook(output_path, rows, with_summary=True):
+    """Write Transactions (and optionally Annual Summary) from in-memory rows."""
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    summary = None
+    if with_summary:
+        with instrumentation.stage("annual_summary"):
+            summary = summarize_sales(df)
+
+    # Replace our sheets but keep anything else the user added to the workbook
+    with instrumentation.stage("spreadsheet_write"):
+        mode = "a" if os.path.exists(output_path) else "w"
+        with pd.ExcelWriter(output_path, engine="openpyxl", mode=mode,
+                            if_sheet_exists="replace" if mode == "a" else None) as writer:
+            df.to_excel(writer, sheet_name="Transactions", index=False)
+            if summary is not None:
+                summary.to_excel(writer, sheet_name="Annual Summary", index=False)
+    instrumentation.incr("rows_written", len(df))
+    instrumentation.incr("xlsx_bytes_written", os.path.getsize(output_path))
+
+def summarize_sales(df):
+    """Group sale rows of a Transactions frame into the Annual Summary."""
+    if df.empty:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    df = df.copy()
+    df["Date"] = pd.to_datetime(df["Date"])
+
+    # Filter and process sales data, with the superficial-loss rows that adjust them
+    sales_df = df[df["Type"].isin(["Sale", "Sale_to_Cover", "Superficial_Loss"])].copy()
+    sales_df["Year"] = sales_df["Date"].dt.year
+
+    # Reporting period and inclusion rate of every sale in one table lookup
+    calendar = get_calendar()
+    codes = calendar.codes(sales_df["Date"].to_numpy())
+    sales_df["Period"] = np.asarray(calendar.labels, dtype=object)[codes]
+    sales_df["Inclusion_Rate"] = np.asarray(calendar.inclusion_rates)[codes]
+
+    # Calculate metrics. A denied superficial loss has no proceeds and takes
+    # its amount back off the cost basis of the sales.
+    denied = sales_df["Type"] == "Superficial_Loss"
+    sales_df["Proceeds_USD"] = (sales_df["Sale Price (USD)"] * abs(sales_df["Shares Added/Sold"])).fillna(0.0)
+    sales_df["Cost_Basis_USD"] = abs(sales_df["ACB Impact (USD)"]).where(~denied, -sales_df["ACB Impact (USD)"])
+    sales_df["Capital_Gain_Loss_USD"] = sales_df["Proceeds_USD"] - sales_df["Cost_Basis_USD"]
+    sales_df["Proceeds_CAD"] = (sales_df["Sale Price (CAD)"] * abs(sales_df["Shares Added/Sold"])).fillna(0.0)
+    sales_df["Cost_Basis_CAD"] = abs(sales_df["ACB Impact (CAD)"]).where(~denied, -sales_df["ACB Impact (CAD)"])
+    sales_df["Capital_Gain_Loss_CAD"] = sales_df["Proceeds_CAD"] - sales_df["Cost_Basis_CAD"]
+    sales_df["Taxable_Capital_Gain_CAD"] = sales_df["Capital_Gain_Loss_CAD"] * sales_df["Inclusion_Rate"]
+
+    # Group by Year and Period
+    annual_summary = sales_df.groupby(["Year", "Period"]).agg(
+        Proceeds_USD=("Proceeds_USD", "sum"),
+        Proceeds_CAD=("Proceeds_CAD", "sum"),
+        Cost_Basis_USD=("Cost_Basis_USD", "sum"),
+        Cost_Basis_CAD=("Cost_Basis_CAD", "sum"),
+        Capital_Gain_Loss_USD=("Capital_Gain_Loss_USD", "sum"),
+        Capital_Gain_Loss_CAD=("Capital_Gain_Loss_CAD", "sum"),
+        Inclusion_Rate=("Inclusion_Rate", "first"),
+        Taxable_Capital_Gain_CAD=("Taxable_Capital_Gain_CAD", "sum"),
+    ).reset_index()
+
+    # Reorder columns and sort
+    return annual_summary[SUMMARY_COLUMNS].sort_values(["Year", "Period"])
+
+def create_annual_summary(output_path="stock_tracker.xlsx", rows=None):
+    """Generate Annual Summary, split into the periods configured in tax_periods.json.
+
+    When rows are given (e.g. LedgerWriter.rows) the summary is computed from
+    them instead of re-reading the Transactions sheet.
+    """
+    if rows is None and not os.path.exists(output_path):
         print("No transactions file found. Creating empty template.")
         with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
             pd.DataFrame(columns=COLUMNS).to_excel(writer, sheet_name="Transactions", index=False)
-            summary_columns = [
-                "Year", "Period",
-                "Proceeds_USD", "Proceeds_CAD",
-                "Cost_Basis_USD", "Cost_Basis_CAD",
-                "Capital_Gain_Loss_USD", "Capital_Gain_Loss_CAD"
-            ]
-            pd.DataFrame(columns=summary_columns).to_excel(writer, sheet_name="Annual Summary", index=False)
+            pd.DataFrame(columns=SUMMARY_COLUMNS).to_excel(writer, sheet_name="Annual Summary", index=False)
         return
 
     try:
-        # Read transactions data
-        df = pd.read_excel(output_path, sheet_name="Transactions", engine="openpyxl")
-        df["Date"] = pd.to_datetime(df["Date"])
-        
-        # Filter and process sales data
-        sales_df = df[df["Type"].isin(["Sale", "Sale_to_Cover"])].copy()
-        sales_df["Year"] = sales_df["Date"].dt.year
-        
-        # Initialize Period column
-        sales_df["Period"] = "Full Year"
-        
-        # Split 2024 into two periods
-        mask_2024 = sales_df["Year"] == 2024
-        if mask_2024.any():  # Only process if 2024 data exists
-            # Create mask for period 1 (Jan 1 - Jun 24)
-            period1_mask = (sales_df["Date"] >= "2024-01-01") & (sales_df["Date"] <= "2024-06-24")
-            
-            # Update periods only for 2024 transactions
-            sales_df.loc[mask_2024, "Period"] = np.where(
-                period1_mask[mask_2024],  # Apply only to 2024 rows
-                "Period 1 (Jan 1 - Jun 24)",
-                "Period 2 (Jun 25 - Dec 31)"
-            )
-
-        # Calculate metrics
-        sales_df["Proceeds_USD"] = sales_df["Sale Price (USD)"] * abs(sales_df["Shares Added/Sold"])
-        sales_df["Cost_Basis_USD"] = abs(sales_df["ACB Impact (USD)"])
-        sales_df["Capital_Gain_Loss_USD"] = sales_df["Proceeds_USD"] - sales_df["Cost_Basis_USD"]
-        sales_df["Proceeds_CAD"] = sales_df["Sale Price (CAD)"] * abs(sales_df["Shares Added/Sold"])
-        sales_df["Cost_Basis_CAD"] = abs(sales_df["ACB Impact (CAD)"])
-        sales_df["Capital_Gain_Loss_CAD"] = sales_df["Proceeds_CAD"] - sales_df["Cost_Basis_CAD"]
-
-        # Group by Year and Period
-        annual_summary = sales_df.groupby(["Year", "Period"]).agg(
-            Proceeds_USD=("Proceeds_USD", "sum"),
-            Proceeds_CAD=("Proceeds_CAD", "sum"),
-            Cost_Basis_USD=("Cost_Basis_USD", "sum"),
-            Cost_Basis_CAD=("Cost_Basis_CAD", "sum"),
-            Capital_Gain_Loss_USD=("Capital_Gain_Loss_USD", "sum"),
-            Capital_Gain_Loss_CAD=("Capital_Gain_Loss_CAD", "sum"),
-        ).reset_index()
-
-        # Reorder columns and sort
-        annual_summary = annual_summary[[
-            "Year", "Period",
-            "Proceeds_USD", "Proceeds_CAD",
-            "Cost_Basis_USD", "Cost_Basis_CAD",
-            "Capital_Gain_Loss_USD", "Capital_Gain_Loss_CAD"
-        ]].sort_values(["Year", "Period"])
+        if rows is None:
+            # Read transactions data
+            df = pd.read_excel(output_path, sheet_name="Transactions", engine="openpyxl")
+        else:
+            df = pd.DataFrame(rows, columns=COLUMNS)
+
+        annual_summary = summarize_sales(df)
 
         # Save annual summary
+        mode = "a" if os.path.exists(output_path) else "w"
         with pd.ExcelWriter(
             output_path,
             engine="openpyxl",
-            mode="a",
-            if_sheet_exists="replace"
+            mode=mode,
+            if_sheet_exists="replace" if mode == "a" else None
         ) as writer:
             annual_summary.to_excel(writer, sheet_name="Annual Summary", index=False)
 
     except Exception as e:
         print(f"Error generating annual summary: {str(e)}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,68 @@
+from bisect import bisect_left, bisect_right
+from records import Transaction
+
+# A loss is superficial if identical shares are acquired from 30 days before
+# to 30 days after the sale and are still held at the end of that window
+WINDOW_DAYS = 30
+
+class AcquisitionIndex:
+    """Date-sorted acquisitions and holdings for superficial-loss window queries.
+
+    Built once from the whole date-sorted ledger (RSU vests and ESPP purchases
+    are the acquisitions), so each sale's window is answered with a couple of
+    bisects instead of a rescan. Share counts are integer micro-shares.
+    """
+
+    def __init__(self, transactions):
+        self.acquired_ordinals = []
+        self.acquired_totals = [0]  # running sum: shares acquired up to each entry
+        self.held_ordinals = []
+        self.held = []  # shares held after the last event on each date
+        shares_held = 0
+        for transaction in transactions:
+            if not isinstance(transaction, Transaction):
+                transaction = Transaction.from_dict(transaction)
+            acquired = transaction.shares if transaction.type in ("RSU", "RSU_Vest", "ESPP") else 0
+            if acquired:
+                self.acquired_ordinals.append(transaction.ordinal)
+                self.acquired_totals.append(self.acquired_totals[-1] + acquired)
+
+            shares_held += acquired - transaction.shares_sold
+            if self.held_ordinals and self.held_ordinals[-1] == transaction.ordinal:
+                self.held[-1] = shares_held
+            else:
+                self.held_ordinals.append(transaction.ordinal)
+                self.held.append(shares_held)
+
+    def acquired_between(self, first_ordinal, last_ordinal):
+        """Shares acquired from first_ordinal to last_ordinal, inclusive."""
+        i = bisect_left(self.acquired_ordinals, first_ordinal)
+        j = bisect_right(self.acquired_ordinals, last_ordinal)
+        return self.acquired_totals[j] - self.acquired_totals[i]
+
+    def held_at(self, ordinal):
+        """Shares held at the end of the given day."""
+        i = bisect_right(self.held_ordinals, ordinal)
+        return self.held[i - 1] if i else 0
+
+    def denied_fraction(self, sale):
+        """Share of a sale's loss that is superficial, from 0.0 to 1.0.
+
+        That is min(sold, acquired in the window, held at window end) / sold.
+        A sale-to-cover disposes of shares from its own vest, so those are not
+        counted as substitutes for themselves.
+        """
+        if sale.shares_sold <= 0:
+            return 0.0
+        acquired = self.acquired_between(sale.ordinal - WINDOW_DAYS, sale.ordinal + WINDOW_DAYS)
+        if sale.type == "Sale_to_Cover":
+            acquired -= sale.shares_sold
+        denied = min(sale.shares_sold, acquired, self.held_at(sale.ordinal + WINDOW_DAYS))
+        return max(denied, 0) / sale.shares_sold
+
+def last_loss_date(rows):
+    """Date of the latest sale row with a capital loss, or None."""
+    for row in reversed(rows):
+        if row["Type"] in ("Sale", "Sale_to_Cover") and row["Capital Gain/Loss (USD)"] < 0:
+            return row["Date"]
+    return None
@@ -2,57 +2,69 @@ from decimal import Decimal, getcontext
 
 getcontext().prec = 8  # High precision for financial calculations
 
+def _decimal(value):
+    # Running totals and rates are passed through as Decimals; accept floats too
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
 def calculate_tax_data(data, exchange_rate):
-    """Calculate taxable income and ACB for RSU_Vest or ESPP transactions."""
-    if data["type"] == "RSU_Vest":
+    """Calculate taxable income and ACB for RSU_Vest or ESPP Transactions.
+
+    Amounts are returned as Decimals.
+    """
+    exchange_rate = _decimal(exchange_rate)
+    if data.type == "RSU_Vest":
         # RSU Vesting (USD calculations first)
-        fmv_usd = Decimal(str(data["fmv_usd"]))
-        shares_vested = Decimal(str(data["shares"]))
+        fmv_usd = data.decimal("fmv")
+        shares_vested = data.decimal("shares")
         
         # Taxable income (USD -> CAD)
         taxable_income_usd = fmv_usd * shares_vested
-        taxable_income_cad = taxable_income_usd * Decimal(str(exchange_rate))
+        taxable_income_cad = taxable_income_usd * exchange_rate
         
         # ACB in USD
         total_acb_usd = fmv_usd * shares_vested
         
         return {
-            "taxable_income_cad": float(taxable_income_cad),
-            "capital_gain_loss": 0.0,
-            "total_acb_usd": float(total_acb_usd),
-            "total_acb_cad": float(total_acb_usd * Decimal(str(exchange_rate)))
+            "taxable_income_cad": taxable_income_cad,
+            "capital_gain_loss": Decimal('0'),
+            "total_acb_usd": total_acb_usd,
+            "total_acb_cad": total_acb_usd * exchange_rate
         }
     
-    elif data["type"] == "ESPP":
+    elif data.type == "ESPP":
         # ESPP Purchase (USD calculations first)
-        fmv_usd = Decimal(str(data["fmv_usd"]))
-        purchase_price_usd = Decimal(str(data["purchase_price_usd"]))
-        shares = Decimal(str(data["shares"]))
+        fmv_usd = data.decimal("fmv")
+        purchase_price_usd = data.decimal("purchase_price")
+        shares = data.decimal("shares")
         
         # Taxable benefit (USD -> CAD)
         taxable_benefit_usd = (fmv_usd - purchase_price_usd) * shares
-        taxable_income_cad = taxable_benefit_usd * Decimal(str(exchange_rate))
+        taxable_income_cad = taxable_benefit_usd * exchange_rate
         
         # ACB in USD
         total_acb_usd = fmv_usd * shares
         
         return {
-            "taxable_income_cad": float(taxable_income_cad),
-            "capital_gain_loss": 0.0,
-            "total_acb_usd": float(total_acb_usd),
-            "total_acb_cad": float(total_acb_usd * Decimal(str(exchange_rate)))
+            "taxable_income_cad": taxable_income_cad,
+            "capital_gain_loss": Decimal('0'),
+            "total_acb_usd": total_acb_usd,
+            "total_acb_cad": total_acb_usd * exchange_rate
         }
 
 def process_sale(sale_data, current_shares, current_acb_usd, exchange_rate):
-    """Calculate capital gains/losses with USD-based ACB."""
-    shares_sold = Decimal(str(abs(sale_data["shares_sold"])))
-    sale_price_usd = Decimal(str(sale_data["sale_price_usd"]))
+    """Calculate capital gains/losses with USD-based ACB.
+
+    Takes the running totals and returns the amounts as Decimals.
+    """
+    shares_sold = abs(sale_data.decimal("shares_sold"))
+    sale_price_usd = sale_data.decimal("sale_price")
+    exchange_rate = _decimal(exchange_rate)
     
     if current_shares <= 0:
         raise ValueError("No shares to sell!")
     
     # ACB per share (USD)
-    acb_per_share_usd = Decimal(str(current_acb_usd)) / Decimal(str(current_shares))
+    acb_per_share_usd = _decimal(current_acb_usd) / _decimal(current_shares)
     
     # Proceeds (USD)
     proceeds_usd = shares_sold * sale_price_usd
@@ -64,16 +76,30 @@ def process_sale(sale_data, current_shares, current_acb_usd, exchange_rate):
     capital_gain_loss_usd = proceeds_usd - acb_sold_usd
     
     # CAD conversions
-    capital_gain_loss_cad = capital_gain_loss_usd * Decimal(str(exchange_rate))
+    capital_gain_loss_cad = capital_gain_loss_usd * exchange_rate
     
     return {
         # USD values
-        "proceeds_usd": float(proceeds_usd),
-        "acb_sold_usd": float(acb_sold_usd),
-        "capital_gain_loss_usd": float(capital_gain_loss_usd),
+        "proceeds_usd": proceeds_usd,
+        "acb_sold_usd": acb_sold_usd,
+        "capital_gain_loss_usd": capital_gain_loss_usd,
         
         # CAD values
-        "proceeds_cad": float(proceeds_usd * Decimal(str(exchange_rate))),
-        "acb_sold_cad": float(acb_sold_usd * Decimal(str(exchange_rate))),
-        "capital_gain_loss_cad": float(capital_gain_loss_cad)
-    }
\ No newline at end of file
+        "proceeds_cad": proceeds_usd * exchange_rate,
+        "acb_sold_cad": acb_sold_usd * exchange_rate,
+        "capital_gain_loss_cad": capital_gain_loss_cad
+    }
+
+def superficial_loss_adjustment(sale_tax_data, denied_fraction, exchange_rate):
+    """Deny the superficial part of a sale's loss and add it back to the ACB."""
+    denied_loss_usd = -sale_tax_data["capital_gain_loss_usd"] * Decimal(str(denied_fraction))
+    denied_loss_cad = denied_loss_usd * _decimal(exchange_rate)
+
+    return {
+        # The denied loss is no longer a capital loss...
+        "capital_gain_loss_usd": denied_loss_usd,
+        "capital_gain_loss": denied_loss_cad,
+        # ...and is added to the ACB of the shares still held instead
+        "total_acb_usd": denied_loss_usd,
+        "total_acb_cad": denied_loss_cad
+    }
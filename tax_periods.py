@@ -0,0 +1,87 @@
+import json
+import os
+from array import array
+from datetime import date
+from records import date_ordinal
+
+# Reporting periods and capital gains inclusion rates, kept as data so a new
+# year or rule change is an edit to this file rather than to the summary code
+TAX_PERIODS_PATH = os.environ.get(
+    "TAX_PERIODS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tax_periods.json"))
+
+# Proleptic Gregorian ordinal of 1970-01-01, for converting datetime64[D] values
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+class TaxCalendar:
+    """Maps any date to its reporting period and inclusion rate.
+
+    Periods are precomputed into a table holding one small integer code per
+    day between the first configured start and the last configured end; code
+    0 is the default period, used for every day outside the configured ones.
+    """
+
+    def __init__(self, periods, default_label="Full Year", default_rate=0.5):
+        self.labels = [default_label]
+        self.inclusion_rates = [default_rate]
+        self.first = self.last = 0
+        self.table = array("B")
+        if not periods:
+            return
+
+        spans = [(date.fromisoformat(p["start"]).toordinal(), date.fromisoformat(p["end"]).toordinal())
+                 for p in periods]
+        self.first = min(start for start, _ in spans)
+        self.last = max(end for _, end in spans)
+        self.table = array("B", bytes(self.last - self.first + 1))
+        for code, (period, (start, end)) in enumerate(zip(periods, spans), 1):
+            if end < start:
+                raise ValueError(f"Tax period {period['label']!r} ends before it starts")
+            for day in range(start - self.first, end - self.first + 1):
+                if self.table[day]:
+                    raise ValueError(f"Tax period {period['label']!r} overlaps "
+                                     f"{self.labels[self.table[day]]!r}")
+                self.table[day] = code
+            self.labels.append(period["label"])
+            self.inclusion_rates.append(float(period["inclusion_rate"]))
+
+    def code(self, ordinal):
+        """Period code of one date, given as a proleptic Gregorian ordinal."""
+        if self.first <= ordinal <= self.last:
+            return self.table[ordinal - self.first]
+        return 0
+
+    def period_of(self, date_str):
+        """(label, inclusion rate) of an MM-DD-YYYY date."""
+        code = self.code(date_ordinal(date_str))
+        return self.labels[code], self.inclusion_rates[code]
+
+    def codes(self, dates):
+        """Period codes for a datetime64 array, as one vectorized table lookup."""
+        import numpy as np
+        ordinals = np.asarray(dates, dtype="datetime64[D]").astype(np.int64) + _EPOCH_ORDINAL
+        if not len(self.table):
+            return np.zeros(len(ordinals), dtype=np.uint8)
+        table = np.frombuffer(self.table, dtype=np.uint8)
+        inside = (ordinals >= self.first) & (ordinals <= self.last)
+        return np.where(inside, table[np.clip(ordinals - self.first, 0, len(table) - 1)], 0).astype(np.uint8)
+
+def load_calendar(path=TAX_PERIODS_PATH):
+    """Build a TaxCalendar from a JSON config; only the default period if it is missing."""
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        print(f"No tax period config at {path}; reporting every year as a single period")
+        config = {}
+    default = config.get("default", {})
+    return TaxCalendar(config.get("periods", []),
+                       default.get("label", "Full Year"), default.get("inclusion_rate", 0.5))
+
+_calendar = None
+
+def get_calendar():
+    """The calendar from TAX_PERIODS_PATH, loaded once per process."""
+    global _calendar
+    if _calendar is None:
+        _calendar = load_calendar()
+    return _calendar
@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+import exchange_rate
+
+class StubValet:
+    """Local stand-in for the Bank of Canada Valet API.
+
+    Answers every date in the requested window with `rate`. The first
+    requests can be scripted to fail: "503" answers with that status and
+    "timeout" answers only after the client has given up. `delay(start)`
+    slows down the answer for a window starting on `start`.
+    """
+
+    def __init__(self):
+        self.rate = "1.3"
+        self.script = []
+        self.delay = lambda start: 0.0
+        self.requests = []  # (start_date, end_date) of each request, in arrival order
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.url = None
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                start = date.fromisoformat(query["start_date"][0])
+                end = date.fromisoformat(query["end_date"][0])
+                with stub.lock:
+                    stub.requests.append((start.isoformat(), end.isoformat()))
+                    action = stub.script.pop(0) if stub.script else None
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    if action == "503":
+                        self.send_response(503)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    time.sleep(exchange_rate.REQUEST_TIMEOUT * 2 if action == "timeout" else stub.delay(start))
+                    observations = [{"d": (start + timedelta(days=i)).isoformat(), "FXUSDCAD": {"v": stub.rate}}
+                                    for i in range((end - start).days + 1)]
+                    body = json.dumps({"observations": observations}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up on a timed-out request
+                finally:
+                    with stub.lock:
+                        stub.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+@pytest.fixture
+def valet(monkeypatch):
+    """A StubValet that exchange_rate fetches from for the duration of a test."""
+    stub = StubValet()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stub.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(exchange_rate, "VALET_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(exchange_rate, "REQUEST_TIMEOUT", 0.5)
+    try:
+        yield stub
+    finally:
+        server.shutdown()
+        server.server_close()
+        exchange_rate.close_session()
@@ -0,0 +1,83 @@
+from decimal import Decimal, localcontext
+import numpy as np
+import pytest
+from acb_engine import compute_acb, ledger_columns, synthetic_columns
+from records import Transaction, date_ordinal, to_micro
+from tax_calculator import calculate_tax_data, process_sale
+
+def compute_acb_scalar(deltas, prices, rates):
+    """Reference path: the per-transaction Decimal math process_all_data runs."""
+    n = len(deltas)
+    result = {key: np.zeros(n) for key in (
+        "shares", "acb_usd", "acb_cad", "proceeds_usd", "acb_sold_usd",
+        "acb_sold_cad", "capital_gain_loss_usd", "capital_gain_loss_cad")}
+    result["skipped"] = np.zeros(n, dtype=bool)
+
+    with localcontext() as ctx:
+        ctx.prec = 8
+        current_shares = Decimal('0')
+        current_acb_usd = Decimal('0')
+        for i in range(n):
+            delta, price, fx = float(deltas[i]), float(prices[i]), float(rates[i])
+            if delta >= 0:
+                purchase = Transaction("ESPP", 0, shares=to_micro(delta), fmv=to_micro(price),
+                                       purchase_price=to_micro(price))
+                tax_data = calculate_tax_data(purchase, fx)
+                current_shares += purchase.decimal("shares")
+                current_acb_usd += tax_data["total_acb_usd"]
+            elif current_shares <= 0:
+                result["skipped"][i] = True
+            else:
+                sold = Transaction("Sale", 0, shares_sold=to_micro(-delta), sale_price=to_micro(price))
+                sale = process_sale(sold, current_shares, current_acb_usd, fx)
+                current_shares -= sold.decimal("shares_sold")
+                current_acb_usd -= sale["acb_sold_usd"]
+                for key in ("proceeds_usd", "acb_sold_usd", "acb_sold_cad",
+                            "capital_gain_loss_usd", "capital_gain_loss_cad"):
+                    result[key][i] = float(sale[key])
+            result["shares"][i] = float(current_shares)
+            result["acb_usd"][i] = float(current_acb_usd)
+            result["acb_cad"][i] = float(current_acb_usd * Decimal(str(fx)))
+    return result
+
+def assert_parity(deltas, prices, rates):
+    # The scalar path keeps 8 significant digits, so amounts of $100k and
+    # above are only compared to that precision rather than to the cent
+    fast = compute_acb(deltas, prices, rates)
+    slow = compute_acb_scalar(deltas, prices, rates)
+    np.testing.assert_array_equal(fast["skipped"], slow["skipped"])
+    for key, expected in slow.items():
+        if key != "skipped":
+            tolerance = np.maximum(0.01, np.abs(expected) * 1e-7)
+            assert (np.abs(fast[key] - expected) <= tolerance).all(), key
+    return fast
+
+@pytest.mark.parametrize("seed", [0, 3])
+def test_matches_scalar_path(seed):
+    assert_parity(*synthetic_columns(2_000, seed=seed))
+
+def test_sales_without_holdings_are_skipped():
+    # Two sales before anything is held, then a full sell-out followed by
+    # another sale with nothing left
+    deltas, prices, rates = synthetic_columns(500, seed=1)
+    deltas = np.concatenate(([-1.0, -2.0, 10.0, -10.0, -3.0, 5.0, -5.0, -1.0, 7.0], deltas))
+    prices = np.concatenate((np.full(9, 50.0), prices))
+    rates = np.concatenate((np.full(9, 1.3), rates))
+
+    result = assert_parity(deltas, prices, rates)
+
+    assert result["skipped"][:9].tolist() == [True, True, False, False, True, False, False, True, False]
+    assert result["shares"][8] == 7.0
+    assert result["acb_usd"][8] == pytest.approx(350.0)
+
+def test_ledger_columns_expand_rsu_releases():
+    ledger = [Transaction("RSU", date_ordinal("03-11-2024"), shares=to_micro(10), fmv=to_micro(39),
+                          shares_sold=to_micro(3), sale_price=to_micro(38.5)),
+              Transaction("RSU", date_ordinal("06-11-2024"), shares=to_micro(4), fmv=to_micro(41)),
+              Transaction("Sale", date_ordinal("07-02-2024"), shares_sold=to_micro(2.5), sale_price=to_micro(45))]
+
+    deltas, prices, rates = ledger_columns(ledger, lambda date_str: 1.25 if date_str < "06" else 1.35)
+
+    assert deltas.tolist() == [10.0, -3.0, 4.0, -2.5]
+    assert prices.tolist() == [39.0, 38.5, 41.0, 45.0]
+    assert rates.tolist() == [1.25, 1.25, 1.35, 1.35]
@@ -0,0 +1,29 @@
+from exchange_rate import _month_bounds, fetch_windows
+
+def month_windows(year, months):
+    return [tuple(day.isoformat() for day in _month_bounds(f"{year}-{month:02d}")) for month in months]
+
+def test_fetch_windows_retries_and_keeps_order(valet):
+    # The first request gets a 503 and the second outlives the timeout; earlier
+    # windows answer later, so they finish out of order
+    valet.script = ["503", "timeout"]
+    valet.delay = lambda start: 0.03 * (7 - start.month)
+    windows = month_windows(2024, range(1, 7))
+
+    results = fetch_windows(windows, max_concurrency=4)
+
+    for (first, last), observations in zip(windows, results):
+        assert observations[0] == (first, 1.3)
+        assert observations[-1][0] == last
+    # Six windows, plus one retry after the 503 and one after the timeout
+    assert len(valet.requests) == len(windows) + 2
+    assert valet.max_in_flight >= 2
+
+def test_fetch_windows_sequential_with_one_slot(valet):
+    windows = month_windows(2024, range(1, 4))
+
+    results = fetch_windows(windows, max_concurrency=1)
+
+    assert [observations[0][0] for observations in results] == [first for first, _ in windows]
+    assert valet.requests == windows
+    assert valet.max_in_flight == 1
@@ -0,0 +1,37 @@
+import pytest
+import pdf_parser
+from benchmark import rsu_confirmation
+from pdf_parser import extract_pdf_data, extract_records
+
+RSU = ("EMPLOYEE STOCK PLAN RELEASE CONFIRMATION\nRelease Date 04-01-2024\n"
+       "Shares Released 5.0000\nMarket Value Per Share $50.0000\nShares Sold (1.0000)\n"
+       "Sale Price Per Share $49.5000\n")
+
+@pytest.mark.parametrize("text, expected", [
+    # One grant, with a totals line and a second page repeating the header
+    (RSU + "Total Sale Price Per Share $49\nRelease Date 04-01-2024\n", [(5.0, 1.0, 49.5)]),
+    # One grant split over two pages by a repeated header
+    ("Release Date 04-01-2024\nShares Released 5.0000\nRelease Date 04-01-2024\n"
+     "Market Value Per Share $50.0000\n", [(5.0, 0.0, 0.0)]),
+    # Two grants released the same day
+    (RSU + RSU.replace("5.0000", "7.0000"), [(5.0, 1.0, 49.5), (7.0, 1.0, 49.5)]),
+])
+def test_extract_rsu_records(text, expected):
+    records = extract_records("RSU", text)
+    assert [(r["shares_vested"], r["shares_sold"], r["sale_price_usd"]) for r in records] == expected
+
+def test_espp_grant_without_prices_is_rejected():
+    with pytest.raises(ValueError, match="missing Purchase Value per Share"):
+        extract_records("ESPP", "Purchase Date 02-28-2024\nShares Purchased 3.0\n")
+
+def test_raw_pass_failure_falls_back_to_pdfplumber(tmp_path, monkeypatch):
+    pdf_path = tmp_path / "release.pdf"
+    pdf_path.write_bytes(rsu_confirmation("04-01-2024", 5, 50.0, 1, 49.5))
+    expected = extract_pdf_data(str(pdf_path))
+
+    def broken(path):
+        raise TypeError("pdfminer internals changed")
+    monkeypatch.setattr(pdf_parser, "_extract_raw", broken)
+
+    assert extract_pdf_data(str(pdf_path)) == expected
+    assert expected[0]["shares_vested"] == 5.0
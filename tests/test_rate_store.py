@@ -0,0 +1,100 @@
+import sqlite3
+import time
+from datetime import date
+from exchange_rate import RateStore, prefetch_exchange_rates
+
+def months_table(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {month: (fetched_at, complete) for month, fetched_at, complete in
+                conn.execute("SELECT month, fetched_at, complete FROM months")}
+    finally:
+        conn.close()
+
+def age_month(path, month, seconds):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("UPDATE months SET fetched_at = fetched_at - ? WHERE month = ?", (seconds, month))
+    conn.close()
+
+def test_complete_month_is_never_refetched(valet, tmp_path):
+    path = str(tmp_path / "fx.sqlite")
+    store = RateStore(path, max_age=0)
+    prefetch_exchange_rates("03-15-2024", "03-20-2024", store=store)
+    store.close()
+    assert valet.requests == [("2024-03-01", "2024-03-31")]
+    assert months_table(path)["2024-03"][1] == 1
+
+    # Even with every copy stale and a fresh process memo, a finished month is final
+    age_month(path, "2024-03", 10 * 365 * 86400)
+    store = RateStore(path, max_age=0)
+    index = prefetch_exchange_rates("03-15-2024", "03-20-2024", store=store)
+    store.close()
+    assert len(valet.requests) == 1
+    assert index.lookup("03-18-2024") == 1.3
+
+def test_current_month_is_refetched_once_stale(valet, tmp_path):
+    path = str(tmp_path / "fx.sqlite")
+    today = date.today()
+    month = today.strftime("%Y-%m")
+    store = RateStore(path, max_age=3600)
+    prefetch_exchange_rates(today.strftime("%m-%d-%Y"), today.strftime("%m-%d-%Y"), store=store)
+    requests = len(valet.requests)
+    assert months_table(path)[month][1] == 0
+
+    # Within max_age the partial month is served from the store
+    prefetch_exchange_rates(today.strftime("%m-%d-%Y"), today.strftime("%m-%d-%Y"), store=store)
+    assert len(valet.requests) == requests
+    store.close()
+
+    age_month(path, month, 7200)
+    store = RateStore(path, max_age=3600)
+    prefetch_exchange_rates(today.strftime("%m-%d-%Y"), today.strftime("%m-%d-%Y"), store=store)
+    store.close()
+    assert valet.requests[-1][0] == today.replace(day=1).isoformat()
+    assert len(valet.requests) == requests + 1
+
+def test_month_cached_before_it_ended_is_refetched(valet, tmp_path):
+    path = str(tmp_path / "fx.sqlite")
+    store = RateStore(path)
+    store._connect()
+    store.close()
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("INSERT INTO months VALUES ('2024-03', ?, 0)", (time.time() - 7200,))
+        conn.execute("INSERT INTO observations VALUES ('2024-03-01', 1.25)")
+    conn.close()
+
+    store = RateStore(path, max_age=3600)
+    index = prefetch_exchange_rates("03-15-2024", "03-20-2024", store=store)
+    store.close()
+    assert valet.requests == [("2024-03-01", "2024-03-31")]
+    assert index.lookup("03-18-2024") == 1.3
+    assert months_table(path)["2024-03"][1] == 1
+
+def test_store_without_complete_column_is_migrated(valet, tmp_path):
+    path = str(tmp_path / "fx.sqlite")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executescript("""
+            CREATE TABLE months (month TEXT PRIMARY KEY, fetched_at REAL NOT NULL);
+            CREATE TABLE observations (date TEXT PRIMARY KEY, rate REAL NOT NULL);
+        """)
+        conn.execute("INSERT INTO months VALUES ('2024-02', ?)", (time.time(),))
+        conn.execute("INSERT INTO months VALUES ('2024-03', ?)", (time.time() - 7200,))
+        conn.executemany("INSERT INTO observations VALUES (?, ?)",
+                         [("2024-02-29", 1.35), ("2024-03-01", 1.25)])
+    conn.close()
+
+    store = RateStore(path, max_age=3600)
+    # Old copies count as possibly partial: fresh ones are still served
+    assert store.get_month("2024-02") == [("2024-02-29", 1.35)]
+    assert store.get_month("2024-03") is None
+    index = prefetch_exchange_rates("03-15-2024", "03-20-2024", store=store)
+    store.close()
+
+    assert valet.requests == [("2024-03-01", "2024-03-31")]
+    assert index.lookup("03-18-2024") == 1.3
+    table = months_table(path)
+    assert table["2024-02"][1] == 0
+    assert table["2024-03"][1] == 1
@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+from decimal import Decimal, localcontext
+import numpy as np
+import pytest
+from exchange_rate import RateIndex
+from records import Transaction, to_micro
+from simulator import rates_for_dates, simulate_sales
+from tax_calculator import process_sale
+
+HOLDINGS = {"shares": Decimal("1250.5"), "acb_usd": Decimal("98765.43")}
+PRICES = np.round(np.linspace(40, 200, 100), 2)
+QUANTITIES = np.linspace(10, 1300, 20).round()
+RATES = np.round(np.linspace(1.25, 1.45, 5), 4)
+
+def test_matches_process_sale_on_sampled_scenarios():
+    result = simulate_sales(HOLDINGS, PRICES, QUANTITIES, RATES)
+    candidates = np.argwhere(result["feasible"])
+    rng = np.random.default_rng(0)
+    picked = candidates[rng.choice(len(candidates), 200, replace=False)]
+
+    with localcontext() as ctx:
+        ctx.prec = 8
+        for i, j, k in picked:
+            sale = Transaction("Sale", 0, shares_sold=to_micro(QUANTITIES[j]), sale_price=to_micro(PRICES[i]))
+            expected = float(process_sale(sale, HOLDINGS["shares"], HOLDINGS["acb_usd"],
+                                          float(RATES[k]))["capital_gain_loss_cad"])
+            diff = abs(result["capital_gain_loss_cad"][i, j, k] - expected)
+            assert diff <= max(0.01, abs(expected) * 1e-7), (i, j, k)
+
+def test_selling_more_than_held_is_infeasible():
+    result = simulate_sales(HOLDINGS, [100.0], [1250.5, 1251.0, 0.0], [1.3])
+
+    assert result["feasible"][0, :, 0].tolist() == [True, False, False]
+    assert np.isnan(result["capital_gain_loss_cad"][0, 1:, 0]).all()
+    # Selling everything leaves no ACB per share
+    assert result["shares_remaining"][0, 0, 0] == 0.0
+    assert result["acb_per_share_usd"][0, 0, 0] == 0.0
+
+def test_rates_for_dates_needs_a_fallback_for_future_dates():
+    rate_index = RateIndex([("2024-06-03", 1.37), ("2024-06-04", 1.36)])
+    future = (date.today() + timedelta(days=30)).strftime("%m-%d-%Y")
+
+    assert rates_for_dates(["06-03-2024", "06-05-2024"], rate_index).tolist() == [1.37, 1.36]
+    assert rates_for_dates(["06-04-2024", future], rate_index, fallback_rate=1.4).tolist() == [1.36, 1.4]
+    with pytest.raises(ValueError, match="fallback_rate"):
+        rates_for_dates([future], rate_index)
@@ -0,0 +1,86 @@
+from datetime import date
+from decimal import Decimal, localcontext
+import pandas as pd
+import pytest
+from exchange_rate import RateIndex
+from main import process_transactions
+from records import Transaction, date_ordinal, to_micro
+from spreadsheet_updater import COLUMNS, LedgerWriter, summarize_sales
+from superficial_loss import AcquisitionIndex
+
+SALE_DAY = date_ordinal("06-14-2024")
+
+def tx(type_, ordinal, **amounts):
+    if isinstance(ordinal, str):
+        ordinal = date_ordinal(ordinal)
+    return Transaction(type_, ordinal, **{key: to_micro(value) for key, value in amounts.items()})
+
+def espp(ordinal, shares, fmv=50.0):
+    return tx("ESPP", ordinal, shares=shares, fmv=fmv, purchase_price=fmv * 0.85)
+
+def sale(ordinal, shares, price=40.0):
+    return tx("Sale", ordinal, shares_sold=shares, sale_price=price)
+
+def test_window_includes_30_days_either_side():
+    # Only the purchases 30 days before and 30 days after count: 10 of the 20 sold
+    ledger = [espp(SALE_DAY - 90, 100), espp(SALE_DAY - 31, 5), espp(SALE_DAY - 30, 5),
+              sale(SALE_DAY, 20), espp(SALE_DAY + 30, 5), espp(SALE_DAY + 31, 5)]
+    index = AcquisitionIndex(ledger)
+
+    assert index.acquired_between(SALE_DAY - 30, SALE_DAY + 30) == to_micro(10)
+    assert index.denied_fraction(ledger[3]) == 0.5
+
+def test_no_acquisitions_in_window():
+    ledger = [espp(SALE_DAY - 31, 100), sale(SALE_DAY, 20), espp(SALE_DAY + 31, 5)]
+
+    assert AcquisitionIndex(ledger).denied_fraction(ledger[1]) == 0.0
+
+def test_denial_limited_to_shares_held_at_window_end():
+    # 30 bought back in the window, but only 5 still held 30 days after the sale
+    ledger = [espp(SALE_DAY - 90, 100), sale(SALE_DAY, 40), espp(SALE_DAY + 5, 30),
+              sale(SALE_DAY + 10, 85)]
+    index = AcquisitionIndex(ledger)
+
+    assert index.held_at(SALE_DAY + 30) == to_micro(5)
+    assert index.denied_fraction(ledger[1]) == 5 / 40
+
+@pytest.mark.parametrize("vested, expected", [(3, 0.0), (10, 1.0)])
+def test_sale_to_cover_excludes_its_own_vest(vested, expected):
+    # The shares sold to cover are not substitutes for themselves; the rest of the vest is
+    rsu = tx("RSU", SALE_DAY, shares=vested, fmv=39.0, shares_sold=3, sale_price=38.0)
+    ledger = [espp(SALE_DAY - 90, 100), rsu]
+    index = AcquisitionIndex(ledger)
+
+    assert index.denied_fraction(rsu.sale_to_cover()) == expected
+
+def test_denied_losses_in_acb_and_annual_summary(tmp_path):
+    ledger = [tx("ESPP", "01-02-2024", shares=100, fmv=50, purchase_price=42.5),
+              tx("Sale", "03-01-2024", shares_sold=40, sale_price=40),
+              tx("RSU", "03-11-2024", shares=10, fmv=39, shares_sold=3, sale_price=39),
+              tx("Sale", "04-20-2024", shares_sold=10, sale_price=30)]
+    first, last = ledger[0].ordinal - 10, ledger[-1].ordinal
+    rate_index = RateIndex([(date.fromordinal(day).isoformat(), 1.3) for day in range(first, last + 1)])
+    writer = LedgerWriter(str(tmp_path / "ledger.xlsx"))
+
+    with localcontext() as ctx:
+        ctx.prec = 8
+        shares, acb_usd, acb_cad = process_transactions(
+            ledger, rate_index, writer, Decimal('0'), Decimal('0'), Decimal('0'),
+            AcquisitionIndex(ledger))
+
+    # The 03-01 loss of $400 is a quarter superficial (10 of 40 shares bought back
+    # on 03-11); the sale-to-cover loss is fully denied; the 04-20 loss stands
+    denied = [(row["Date"], row["ACB Impact (USD)"]) for row in writer.rows if row["Type"] == "Superficial_Loss"]
+    assert denied == [("03-01-2024", pytest.approx(100.0)), ("03-11-2024", pytest.approx(32.57143))]
+    assert shares == Decimal("57")
+    assert float(acb_usd) == pytest.approx(2869.5672)
+    assert float(acb_cad) == pytest.approx(2869.5672 * 1.3)
+
+    summary = summarize_sales(pd.DataFrame(writer.rows, columns=COLUMNS))
+    assert len(summary) == 1
+    row = summary.iloc[0]
+    assert row["Year"] == 2024
+    assert row["Proceeds_USD"] == pytest.approx(2017.0)
+    assert row["Cost_Basis_USD"] == pytest.approx(2520.43284)
+    assert row["Capital_Gain_Loss_USD"] == pytest.approx(-503.43284)
+    assert row["Capital_Gain_Loss_CAD"] == pytest.approx(-503.43284 * 1.3)